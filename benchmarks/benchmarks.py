@@ -0,0 +1,275 @@
+""" Benchmarks for element construction, propagation and the full UI refresh, plus golden value checks
+so optimizations can be checked to keep the physics unchanged.
+
+Written for asv (``asv run`` from the repository root), can also be run directly:
+
+    python benchmarks/benchmarks.py
+"""
+import os
+import sys
+import json
+import time
+import runpy
+import tempfile
+
+ROOT = os.path.dirname(os.path.dirname(os.path.abspath(__file__)))
+if ROOT not in sys.path:
+    sys.path.insert(0,ROOT)
+
+import numpy as np
+
+from spectralLibrary import SpectralLibrary, get_library, load_shared_store, component_path_lookup, laser_path_lookup
+from opticalElement import OpticalElement
+from propagation import OpticalChain, power_from_counts
+from opticalGraph import OpticalGraph, SOURCE, REFLECTED
+from sweep import chain_power
+from tolerance import sampled_power
+from incidence import tilt_sweep
+
+GOLDEN = json.load(open(os.path.join(os.path.dirname(os.path.abspath(__file__)),'golden.json')))
+
+VENDOR_PATHS = {'thorlabs':component_path_lookup['Thorlabs 450/10'],
+                'semrock':component_path_lookup['Semrock 468 SP'],
+                'fiber':'Fiber'}
+CHAIN_NAMES = [k for k in component_path_lookup.keys()]
+CHAIN_LENGTHS = [1,5,10,25,50]
+LASER = '445nm Blue'
+
+
+def calc_power(power_frame):
+    """ Same as optical_app.calc_power, without importing the app"""
+    return float(power_from_counts(power_frame['Wavelength'].to_numpy(),power_frame['sum_norm_counts'].to_numpy()))
+
+
+def make_elements(n):
+    return [OpticalElement(name=CHAIN_NAMES[i % len(CHAIN_NAMES)],pos=i+1,csv_path=component_path_lookup[CHAIN_NAMES[i % len(CHAIN_NAMES)]])
+            for i in range(n)]
+
+
+def check_golden():
+    """ Compares power at sample against the golden values through the element, chain and sweep paths"""
+    library = get_library()
+    rtol = GOLDEN['rtol']
+    failures = []
+    for case in GOLDEN['cases']:
+        laser = library.laser(laser_path_lookup[case['laser']])
+        elements = [OpticalElement(name=n,pos=i+1,csv_path=component_path_lookup[n]) for i,n in enumerate(case['chain'])]
+
+        P_temp = laser
+        for e in elements:
+            P_temp = e.propagate(P_temp)
+        P_temp = P_temp.copy()
+        P_temp['sum_norm_counts'] = P_temp['sum_norm_counts'] / case['distance']**2
+
+        chain = OpticalChain(laser['Wavelength'].to_numpy())
+        for i,e in enumerate(elements):
+            chain.append(i,e)
+        chain_counts = chain.propagate(laser['sum_norm_counts'].to_numpy(),case['distance'])
+
+        results = {'element':calc_power(P_temp),
+                   'chain':float(power_from_counts(laser['Wavelength'].to_numpy(),chain_counts)),
+                   'sweep':float(chain_power(case['chain'],[case['laser']],[case['distance']],[0])[0,0,0])}
+        # an untilted sweep has to give the chain power whichever element is swept
+        for i in range(len(elements)):
+            _,_,tilt_power = tilt_sweep(elements,i,laser['sum_norm_counts'].to_numpy(),laser['Wavelength'].to_numpy(),[0],case['distance'])
+            results['tilt_sweep[{0}]'.format(i)] = float(tilt_power[0])
+        for path,power in results.items():
+            if not np.isclose(power,case['power'],rtol=rtol,atol=0):
+                failures.append('{0} {1} d={2} ({3}): {4} != {5}'.format(case['laser'],case['chain'],case['distance'],path,power,case['power']))
+    if failures:
+        raise AssertionError('Golden values changed:\n' + '\n'.join(failures))
+
+
+class _CountingElement(OpticalElement):
+    """ Counts od_at calls, to check that shared parts of a graph are computed once"""
+    def __init__(self,*args,**kwargs):
+        super().__init__(*args,**kwargs)
+        self.calls = 0
+
+    def od_at(self,wavelength):
+        self.calls += 1
+        return super().od_at(wavelength)
+
+
+def check_graph():
+    """ Checks OpticalGraph against the golden values for linear paths, that splitter arms add up to
+    their input and that a shared trunk is computed once"""
+    library = get_library()
+    rtol = GOLDEN['rtol']
+    failures = []
+    for case in GOLDEN['cases']:
+        laser = library.laser(laser_path_lookup[case['laser']])
+        graph = OpticalGraph(laser['Wavelength'].to_numpy())
+        parent = None
+        for i,n in enumerate(case['chain']):
+            parent = graph.add_element(i,OpticalElement(name=n,pos=i+1,csv_path=component_path_lookup[n]),parent=parent)
+        graph.add_sample('sample',parent=parent,distance=case['distance'])
+        power = graph.powers(laser['sum_norm_counts'].to_numpy())['sample']
+        if not np.isclose(power,case['power'],rtol=rtol,atol=0):
+            failures.append('{0} {1} d={2} (graph): {3} != {4}'.format(case['laser'],case['chain'],case['distance'],power,case['power']))
+
+    laser = library.laser(laser_path_lookup[LASER])
+    wavelength = laser['Wavelength'].to_numpy()
+    element = lambda n: _CountingElement(name=n,pos=1,csv_path=component_path_lookup[n])
+    graph = OpticalGraph(wavelength)
+    graph.add_element('ex',element('Thorlabs 450 LP'))
+    graph.add_element('trunk',element('Fiber'),parent='ex')
+    graph.add_splitter('di',element('Semrock 480 Di'),parent='trunk')
+    graph.add_element('em',element('Semrock 468 SP'),parent=('di',REFLECTED))
+    graph.add_splitter('di2',element('Semrock 562 Di'),parent='di')
+    graph.add_sample('camera',parent='em',distance=3)
+    graph.add_sample('monitor',parent=('di2',REFLECTED))
+    graph.add_sample('dump',parent='di2')
+    for _ in range(2):
+        graph.powers(laser['sum_norm_counts'].to_numpy())
+    transmissions = graph.transmissions()
+    for key,node in graph.nodes.items():
+        if node.kind == 'splitter':
+            t_in = sum(np.ones_like(wavelength) if p == SOURCE else transmissions[p][arm] for p,arm in node.parents)
+            arms = transmissions[key]['t'] + transmissions[key]['r']
+            if not np.allclose(arms,t_in,rtol=1e-12,atol=0):
+                failures.append('splitter {0}: arms do not add up to the input'.format(key))
+    calls = {k:n.element.calls for k,n in graph.nodes.items() if n.element is not None}
+    if any(c != 1 for c in calls.values()):
+        failures.append('shared path computed more than once: {0}'.format(calls))
+    graph.invalidate('em')
+    graph.powers(laser['sum_norm_counts'].to_numpy())
+    calls = {k:n.element.calls for k,n in graph.nodes.items() if n.element is not None}
+    if calls != {'ex':1,'trunk':1,'di':1,'em':2,'di2':1}:
+        failures.append('invalidating a branch recomputed other nodes: {0}'.format(calls))
+    if failures:
+        raise AssertionError('Graph checks failed:\n' + '\n'.join(failures))
+
+
+class ElementConstruction:
+    """ OpticalElement.__init__/make_data for each vendor format, from a warm and a cold cache"""
+    params = list(VENDOR_PATHS.keys())
+    param_names = ['vendor']
+
+    def setup(self,vendor):
+        load_shared_store()
+        self.path = VENDOR_PATHS[vendor]
+        self.name = 'Fiber' if vendor == 'fiber' else vendor
+
+    def time_init(self,vendor):
+        OpticalElement(name=self.name,pos=1,csv_path=self.path)
+
+    def time_make_data_cold(self,vendor):
+        # fresh library and cache dir, so the csv is parsed and resampled
+        with tempfile.TemporaryDirectory() as cache_dir:
+            SpectralLibrary(cache_dir=cache_dir).component_array(self.path)
+
+
+class Propagation:
+    """ Propagation through chains of 1 to 50 elements"""
+    params = CHAIN_LENGTHS
+    param_names = ['n_elements']
+
+    def setup(self,n):
+        load_shared_store()
+        self.laser = get_library().laser(laser_path_lookup[LASER])
+        self.wavelength = self.laser['Wavelength'].to_numpy()
+        self.counts = self.laser['sum_norm_counts'].to_numpy()
+        self.elements = make_elements(n)
+        for e in self.elements:
+            e.od_at(self.wavelength)
+
+    def time_element_propagate(self,n):
+        P_temp = self.laser
+        for e in self.elements:
+            P_temp = e.propagate(P_temp)
+
+    def time_chain_full(self,n):
+        chain = OpticalChain(self.wavelength)
+        for i,e in enumerate(self.elements):
+            chain.append(i,e)
+        chain.propagate(self.counts)
+
+    def time_chain_append(self,n):
+        chain = OpticalChain(self.wavelength)
+        for i,e in enumerate(self.elements):
+            chain.append(i,e)
+            chain.propagate(self.counts)
+
+
+class CalcPower:
+    """ Power integration of one spectrum, independent of the chain length"""
+    def setup(self):
+        load_shared_store()
+        self.laser = get_library().laser(laser_path_lookup[LASER])
+
+    def time_calc_power(self):
+        P_temp = self.laser.copy()
+        calc_power(P_temp)
+
+
+class AppRefresh:
+    """ Headless run of optical_app.update_plots_and_propagate_light with a populated chain"""
+    params = [1,5,10]
+    param_names = ['n_elements']
+    timeout = 120
+
+    def setup(self,n):
+        from bokeh.document import Document
+        from bokeh.io.doc import set_curdoc
+        set_curdoc(Document())
+        self.app = runpy.run_path(os.path.join(ROOT,'optical_app.py'),run_name='optical_app')
+        for i in range(n):
+            self.app['component_select'].value = CHAIN_NAMES[i % len(CHAIN_NAMES)]
+            self.app['add_button']()
+
+    def time_update_plots_and_propagate_light(self,n):
+        self.app['update_plots_and_propagate_light']()
+
+    def time_distance_change(self,n):
+        self.app['distance_slider'].value = 1 + (self.app['distance_slider'].value % 20)
+
+
+class Tolerance:
+    """ Monte Carlo tolerance analysis of a 3 element chain"""
+    params = [1000,10000]
+    param_names = ['n_samples']
+    timeout = 120
+
+    def setup(self,n):
+        load_shared_store()
+
+    def time_sampled_power(self,n):
+        sampled_power(LASER,['Semrock 468 SP','Thorlabs 450/10','Fiber'],distance=3,n_samples=n,seed=0)
+
+
+class Golden:
+    """ Fails when the physics moved away from the golden values"""
+    def setup(self):
+        check_golden()
+        check_graph()
+
+    def track_golden_cases(self):
+        return len(GOLDEN['cases'])
+
+
+def _run(obj,method,params,repeat=5):
+    timings = []
+    for _ in range(repeat):
+        t = time.perf_counter()
+        getattr(obj,method)(*params)
+        timings.append(time.perf_counter() - t)
+    return min(timings)
+
+
+def main():
+    check_golden()
+    print('golden values ok ({0} cases)'.format(len(GOLDEN['cases'])))
+    check_graph()
+    print('graph checks ok')
+    for cls in [ElementConstruction,Propagation,CalcPower,AppRefresh,Tolerance]:
+        for param in getattr(cls,'params',[None]):
+            params = () if param is None else (param,)
+            bench = cls()
+            bench.setup(*params)
+            for method in sorted(m for m in dir(cls) if m.startswith('time_')):
+                print('{0}.{1}({2}): {3:.3f} ms'.format(cls.__name__,method,param,1e3*_run(bench,method,params)))
+
+
+if __name__ == '__main__':
+    main()
@@ -0,0 +1,189 @@
+""" Component catalog. Scans the vendor directories, detects the file format of every spectrum and keeps a
+metadata index (wavelength range, pass bands, edges, mean OD) on disk, so parts can be searched and filtered
+without parsing them again. Spectra are parsed once through the SpectralLibrary, which keeps them in its binary cache.
+Does not need bokeh.
+
+    >>> from catalog import get_catalog
+    >>> get_catalog().search(passes=450,blocks=(500,600))
+"""
+import os
+import json
+import threading
+
+import numpy as np
+
+from spectralLibrary import DATA_ROOT, CACHE_DIR, get_library, detect_format, component_path_lookup
+
+CATALOG_DIRS = ['csv_data/thorlabs','csv_data/semrock']
+# bump this when the metadata changes
+INDEX_VERSION = 1
+INDEX_FILE = os.path.join(CACHE_DIR,'catalog.json')
+# a part passes where its OD is under this (T > 10%)
+PASS_OD = 1
+# narrower pass bands (nm) are ignored
+MIN_BAND_WIDTH = 1
+# OD used for blocked points in the mean, vendor curves can go to infinity
+MAX_OD = 10
+
+
+def part_name(file_format,filename):
+    """ Display name of a part from its vendor and file name, e.g. Semrock FF01-607_70"""
+    return '{0} {1}'.format(file_format.capitalize(),filename.replace('_Spectrum','').rsplit('.',1)[0])
+
+
+def spectral_metadata(spectrum):
+    """ Range, pass bands, edges and mean OD of a (Wavelength, Transmission, od) array"""
+    # grid values are rounded, they come from np.arange
+    wavelength = np.round(spectrum[:,0],2)
+    od = np.clip(np.nan_to_num(spectrum[:,2],nan=MAX_OD,posinf=MAX_OD),None,MAX_OD)
+    passing = np.concatenate(([False],od < PASS_OD,[False]))
+    change = np.flatnonzero(np.diff(passing.astype(np.int8)))
+    bands = [[float(wavelength[a]),float(wavelength[b-1])] for a,b in zip(change[::2],change[1::2])
+             if wavelength[b-1] - wavelength[a] >= MIN_BAND_WIDTH]
+    # edges are band limits inside the measured range
+    edges = sorted(set(e for band in bands for e in band if wavelength[0] < e < wavelength[-1]))
+    return {'range':[float(wavelength[0]),float(wavelength[-1])],
+            'pass_bands':bands,
+            'edges':edges,
+            'mean_od':float(np.mean(od))}
+
+
+def _as_band(value):
+    """ A wavelength or a (start, end) band as a (start, end) band"""
+    if np.ndim(value) == 0:
+        return float(value),float(value)
+    return float(min(value)),float(max(value))
+
+
+class Catalog:
+    """ Every part of the vendor directories plus the hand picked component_path_lookup entries.
+    Only new or modified files are parsed when the index is refreshed"""
+    def __init__(self,dirs=CATALOG_DIRS,index_file=INDEX_FILE):
+        self.dirs = dirs
+        self.index_file = index_file
+        self._lock = threading.Lock()
+        # path -> metadata
+        self.entries = {}
+        # display name -> path
+        self.names = {}
+        self._load_index()
+
+    def _load_index(self):
+        try:
+            with open(self.index_file) as f:
+                index = json.load(f)
+        except (OSError,ValueError):
+            return
+        if index.get('version') == INDEX_VERSION:
+            self.entries = index['entries']
+
+    def _save_index(self):
+        os.makedirs(os.path.dirname(self.index_file),exist_ok=True)
+        tmp_file = self.index_file + '.{0}.tmp'.format(os.getpid())
+        with open(tmp_file,'w') as f:
+            json.dump({'version':INDEX_VERSION,'entries':self.entries},f)
+        os.replace(tmp_file,self.index_file)
+
+    def scan(self):
+        """ Refreshes the index from the vendor directories, returns the number of parsed files"""
+        with self._lock:
+            entries = {}
+            parsed = 0
+            for directory in self.dirs:
+                full_dir = os.path.join(DATA_ROOT,directory)
+                if not os.path.isdir(full_dir):
+                    continue
+                for filename in sorted(os.listdir(full_dir)):
+                    path = os.path.join(directory,filename).replace(os.sep,'/')
+                    full_path = os.path.join(full_dir,filename)
+                    if not os.path.isfile(full_path):
+                        continue
+                    mtime = os.stat(full_path).st_mtime_ns
+                    entry = self.entries.get(path)
+                    if entry is not None and entry['mtime'] == mtime:
+                        entries[path] = entry
+                        continue
+                    file_format = detect_format(full_path)
+                    if file_format is None:
+                        continue
+                    # fills the binary cache, reused when the part is added, the array itself is not kept mapped
+                    try:
+                        spectrum = get_library().component_array(path,keep=False)
+                    except Exception as e:
+                        print('Skipping {0}: {1}'.format(path,e))
+                        continue
+                    entry = {'name':part_name(file_format,filename),'format':file_format,'mtime':mtime}
+                    entry.update(spectral_metadata(spectrum))
+                    del spectrum
+                    entries[path] = entry
+                    parsed += 1
+            changed = parsed or set(entries) != set(self.entries)
+            self.entries = entries
+            if changed:
+                self._save_index()
+
+            # hand picked names first, the catalog only adds the parts they do not cover
+            self.names = dict(component_path_lookup)
+            known = set(self.names.values())
+            for path,entry in entries.items():
+                if path not in known:
+                    self.names[entry['name']] = path
+            return parsed
+
+    def path(self,name):
+        return self.names[name]
+
+    def metadata(self,name):
+        """ Metadata of a part, None for parts without a file (e.g. Fiber)"""
+        return self.entries.get(self.names[name])
+
+    def search(self,text='',vendor=None,passes=None,blocks=None,max_mean_od=None):
+        """ Names of the parts matching every given criterion.
+        text: case insensitive part of the name or file path
+        vendor: 'thorlabs' or 'semrock'
+        passes: wavelength or (start, end) band that has to be inside one pass band
+        blocks: wavelength or (start, end) band that no pass band may overlap
+        max_mean_od: upper limit of the mean OD"""
+        text = text.strip().lower()
+        spectral = vendor is not None or passes is not None or blocks is not None or max_mean_od is not None
+        if passes is not None:
+            passes = _as_band(passes)
+        if blocks is not None:
+            blocks = _as_band(blocks)
+        found = []
+        for name,path in self.names.items():
+            if text and text not in name.lower() and text not in path.lower():
+                continue
+            entry = self.entries.get(path)
+            if entry is None:
+                if not spectral:
+                    found.append(name)
+                continue
+            if vendor is not None and entry['format'] != vendor:
+                continue
+            if passes is not None and not any(a <= passes[0] and passes[1] <= b for a,b in entry['pass_bands']):
+                continue
+            if blocks is not None and any(a <= blocks[1] and blocks[0] <= b for a,b in entry['pass_bands']):
+                continue
+            if max_mean_od is not None and entry['mean_od'] > max_mean_od:
+                continue
+            found.append(name)
+        return found
+
+
+_catalog = None
+
+def get_catalog():
+    """ Process wide catalog, scanned on first use"""
+    global _catalog
+    if _catalog is None:
+        _catalog = Catalog()
+        _catalog.scan()
+    return _catalog
+
+
+def component_path(name):
+    """ csv path of a component, hand picked names are resolved without scanning the catalog"""
+    if name in component_path_lookup:
+        return component_path_lookup[name]
+    return get_catalog().path(name)
@@ -0,0 +1,41 @@
+""" Angle of incidence of thin film filters. Tilting a filter shifts its spectrum to shorter wavelengths,
+every feature at lambda_0 moves to lambda_0 * sqrt(1 - (sin(theta) / n_eff)^2), n_eff being the effective
+index of the coating. Every angle is evaluated at once on one (cubic, zero padded) spline over the wavelengths
+seen by all the angles, and comes back as one (angles x wavelengths) array. OpticalElement serves 0 deg rows
+from the untilted OD, so they match the chain exactly. Does not need bokeh.
+
+    >>> from incidence import tilt_sweep
+    >>> angles,counts,power = tilt_sweep(elements,0,laser_counts,wavelength,np.arange(0,61))
+"""
+import numpy as np
+
+from propagation import resample_od, stack_od, power_from_counts
+
+# typical effective index of hard coated filters, depends on the coating and the polarization
+DEFAULT_N_EFF = 2.0
+
+
+def shift_factor(angles,n_eff=DEFAULT_N_EFF):
+    """ lambda(theta) / lambda(0) for each angle of incidence (degrees)"""
+    sin_theta = np.sin(np.radians(np.asarray(angles,dtype=float)))
+    return np.sqrt(1 - (sin_theta / n_eff)**2)
+
+
+def od_at_angles(comp_lambda,comp_od,wavelength,angles,n_eff=DEFAULT_N_EFF):
+    """ (n_angles x n_wavelengths) OD of a spectrum tilted to each angle, on the given wavelength axis.
+    One spline (see resample_od) is built over the union of the wavelengths seen at every angle and evaluated once"""
+    wavelength = np.asarray(wavelength,dtype=float)
+    if not np.size(angles):
+        return np.empty((0,len(wavelength)))
+    return resample_od(comp_lambda,comp_od,wavelength[None,:] / shift_factor(np.ravel(angles),n_eff)[:,None])
+
+
+def tilt_sweep(elements,index,counts,wavelength,angles,distance=1):
+    """ Tilts elements[index] through every angle while the others stay as they are.
+    Returns angles, (n_angles x n_wavelengths) counts and (n_angles,) power at the sample"""
+    angles = np.asarray(angles,dtype=float)
+    others = [e for i,e in enumerate(elements) if i != index]
+    rest = np.power(10,-np.sum(stack_od(others,wavelength),axis=0)) if len(others) else 1
+    od = elements[index].od_at_angles(wavelength,angles)
+    sample_counts = np.asarray(counts) * rest * np.power(10,-od) / (distance**2)
+    return angles,sample_counts,power_from_counts(wavelength,sample_counts)
@@ -0,0 +1,147 @@
+""" Hot path timings. Disabled by default, where every stage() is a shared no-op context manager.
+Enable with OPTOPATH_PROFILE=1 (wall time) or OPTOPATH_PROFILE=alloc (wall time and allocations),
+or by calling enable()."""
+import os
+import json
+import time
+import threading
+import tracemalloc
+from functools import wraps
+from contextlib import nullcontext
+
+_enabled = False
+_allocations = False
+_lock = threading.Lock()
+# name -> {'count','total','max','last','alloc'}
+_stats = {}
+_noop = nullcontext()
+
+
+def enable(allocations=False):
+    global _enabled, _allocations
+    _enabled = True
+    _allocations = allocations
+    if allocations and not tracemalloc.is_tracing():
+        tracemalloc.start()
+
+
+def disable():
+    global _enabled, _allocations
+    _enabled = False
+    if _allocations and tracemalloc.is_tracing():
+        tracemalloc.stop()
+    _allocations = False
+
+
+def is_enabled():
+    return _enabled
+
+
+def reset():
+    with _lock:
+        _stats.clear()
+
+
+def record(name,seconds,alloc=0):
+    with _lock:
+        s = _stats.get(name)
+        if s is None:
+            s = _stats[name] = {'count':0,'total':0.0,'max':0.0,'last':0.0,'alloc':0}
+        s['count'] += 1
+        s['total'] += seconds
+        s['last'] = seconds
+        s['max'] = max(s['max'],seconds)
+        s['alloc'] += alloc
+
+
+class _Stage:
+    __slots__ = ('name','t0','m0')
+
+    def __init__(self,name):
+        self.name = name
+
+    def __enter__(self):
+        self.m0 = tracemalloc.get_traced_memory()[0] if _allocations else 0
+        self.t0 = time.perf_counter()
+        return self
+
+    def __exit__(self,*exc):
+        dt = time.perf_counter() - self.t0
+        alloc = max(tracemalloc.get_traced_memory()[0] - self.m0,0) if _allocations else 0
+        record(self.name,dt,alloc)
+        return False
+
+
+def stage(name):
+    """ with stage('propagate'): ...  records wall time (and allocations) of the block when enabled"""
+    if not _enabled:
+        return _noop
+    return _Stage(name)
+
+
+def timed(name):
+    """ Decorator version of stage"""
+    def decorator(func):
+        @wraps(func)
+        def wrapper(*args,**kwargs):
+            if not _enabled:
+                return func(*args,**kwargs)
+            with _Stage(name):
+                return func(*args,**kwargs)
+        return wrapper
+    return decorator
+
+
+def snapshot():
+    with _lock:
+        return {k:dict(v) for k,v in _stats.items()}
+
+
+def report():
+    """ Plain text table for the diagnostics panel"""
+    stats = snapshot()
+    if not len(stats):
+        return 'No timings recorded' + ('' if _enabled else ' (instrumentation disabled, set OPTOPATH_PROFILE=1)')
+    lines = ['{0:<36}{1:>7}{2:>11}{3:>11}{4:>11}{5:>12}'.format('stage','count','mean(ms)','max(ms)','last(ms)','alloc(kB)')]
+    for name in sorted(stats):
+        s = stats[name]
+        lines.append('{0:<36}{1:>7}{2:>11.3f}{3:>11.3f}{4:>11.3f}{5:>12.1f}'.format(name,s['count'],1e3*s['total']/s['count'],
+                                                                                  1e3*s['max'],1e3*s['last'],s['alloc']/1024))
+    return '\n'.join(lines)
+
+
+def export_json(path=None):
+    """ Timings as JSON, written to path if given"""
+    text = json.dumps({'allocations':_allocations,'stages':snapshot()},indent=1)
+    if path is not None:
+        with open(path,'w') as f:
+            f.write(text)
+    return text
+
+
+def export_prometheus(path=None):
+    """ Timings in the Prometheus text exposition format, written to path if given"""
+    stats = snapshot()
+    lines = ['# HELP optopath_stage_seconds Wall time spent in each stage',
+             '# TYPE optopath_stage_seconds summary']
+    for name in sorted(stats):
+        s = stats[name]
+        lines.append('optopath_stage_seconds_count{{stage="{0}"}} {1}'.format(name,s['count']))
+        lines.append('optopath_stage_seconds_sum{{stage="{0}"}} {1!r}'.format(name,s['total']))
+    lines.extend(['# HELP optopath_stage_seconds_max Slowest run of each stage',
+                  '# TYPE optopath_stage_seconds_max gauge'])
+    lines.extend('optopath_stage_seconds_max{{stage="{0}"}} {1!r}'.format(name,stats[name]['max']) for name in sorted(stats))
+    if _allocations:
+        lines.extend(['# HELP optopath_stage_alloc_bytes_total Net bytes allocated in each stage',
+                      '# TYPE optopath_stage_alloc_bytes_total counter'])
+        lines.extend('optopath_stage_alloc_bytes_total{{stage="{0}"}} {1}'.format(name,stats[name]['alloc']) for name in sorted(stats))
+    text = '\n'.join(lines) + '\n'
+    if path is not None:
+        with open(path,'w') as f:
+            f.write(text)
+    return text
+
+
+_profile = os.environ.get('OPTOPATH_PROFILE','')
+if _profile:
+    enable(allocations=(_profile == 'alloc'))
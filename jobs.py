@@ -0,0 +1,58 @@
+import os
+import threading
+import traceback
+from functools import partial
+from concurrent.futures import ThreadPoolExecutor
+
+
+_executor = None
+
+def get_executor():
+    """ Process wide executor shared by every bokeh session"""
+    global _executor
+    if _executor is None:
+        _executor = ThreadPoolExecutor(max_workers=os.cpu_count() or 1,thread_name_prefix='optopath')
+    return _executor
+
+
+class CoalescingRunner:
+    """ Runs the computations of one session off the bokeh event loop, one at a time.
+    Requests that come in while a job is running replace each other, so fast slider drags only compute
+    the latest value. Results are applied on the document with add_next_tick_callback"""
+    def __init__(self,doc,executor=None,synchronous=False):
+        self.doc = doc
+        self.executor = executor
+        self.synchronous = synchronous
+        self._lock = threading.Lock()
+        self._pending = None
+        self._running = False
+
+    def submit(self,compute,apply):
+        """ compute() runs on the executor, apply(result) runs on the bokeh thread"""
+        if self.synchronous:
+            apply(compute())
+            return
+        with self._lock:
+            self._pending = (compute,apply)
+            if self._running:
+                return
+            self._running = True
+        self._start_next()
+
+    def _start_next(self):
+        with self._lock:
+            job = self._pending
+            self._pending = None
+            if job is None:
+                self._running = False
+                return
+        compute,apply = job
+        executor = self.executor or get_executor()
+        executor.submit(compute).add_done_callback(partial(self._done,apply))
+
+    def _done(self,apply,future):
+        try:
+            self.doc.add_next_tick_callback(partial(apply,future.result()))
+        except Exception:
+            traceback.print_exc()
+        self._start_next()
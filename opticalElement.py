@@ -1,91 +1,111 @@
-import pandas as pd
 import numpy as np
-from bokeh.models import ColumnDataSource, Segment, Ellipse
 
-from scipy.interpolate import interp1d
+from spectralLibrary import get_library, COMPONENT_COLUMNS
+from propagation import propagate_counts
+from incidence import od_at_angles, DEFAULT_N_EFF
 
 
 class OpticalElement:
+    """ Array backed optical element. The spectrum is a view into the shared spectral library
+    (float32 OD on the shared grid), bokeh parts are only built when the element is rendered"""
+    __slots__ = ('name','path','pos','color','length','angle','n_eff','is_active','_spectrum','_od','_shape_source','_shape_glyph')
+
+    # glyph size, same for every element
+    shape = {'w':1, 'h':1, 'r':0.25}
+
     def __init__(self,name,pos,csv_path,**kwargs):
         self.name = name
         if not isinstance(pos,list):
-            self.pos = {'x':pos, 'y':-0.5}
+            self.pos = (pos,-0.5)
         else:
-            self.pos = {'x':pos[0], 'y':pos[1]}
+            self.pos = (pos[0],pos[1])
+
+        # fiber length, scales the fiber OD
+        self.length = kwargs.get('length',1)
+        # angle of incidence (degrees) and effective index of the coating, tilt shifts the spectrum
+        self.angle = kwargs.get('angle',0)
+        self.n_eff = kwargs.get('n_eff',DEFAULT_N_EFF)
 
         self.make_data(csv_path)
-        self.set_lambda_range()
-        
-        self.shape = {'w':1, 'h':1, 'r':0.25}
+
         self.color = kwargs.get('color','#336644')
-        self.make_shape()
+        self.is_active = True
+        self._shape_source = None
+        self._shape_glyph = None
 
     def make_data(self,path=None):
-        spectra = np.arange(300,1200,0.2)
+        """ Gets the spectrum from the spectral library, which parses and resamples each csv only once"""
         if self.name == 'Fiber':
-            # assume no loss for now
-            transmission = np.ones_like(spectra) * 0.98
-            od = np.log10(1/transmission)
-            data = np.hstack((spectra.reshape(-1,1),transmission.reshape(-1,1),od.reshape(-1,1)))
-            self.data = pd.DataFrame(data=data, columns=['Wavelength','Transmission','od'])
-
-        if 'thorlabs' in path:
-            temp = pd.read_csv(path,sep = '\t')
-            temp['Transmission'] = temp['Transmission'].apply(lambda x: x/100)
-            trans = interp1d(temp['Wavelength'],temp['Transmission'],kind='cubic')
-            od = interp1d(temp['Wavelength'],temp['od'],kind='cubic')
-            
-            data = np.hstack((spectra.reshape(-1,1), trans(spectra).reshape(-1,1), od(spectra).reshape(-1,1)))
-            self.data = pd.DataFrame(data=data, columns=['Wavelength','Transmission','od'])
-        elif 'semrock' in path:
-            self.data= pd.read_csv(path, sep='\t', header=4)
-            self.data['od'] = self.data['Transmission'].apply(lambda x: np.log10(1/x))
+            path = 'Fiber'
+        self.path = path
+        library = get_library()
+        self._spectrum = library.component_array(path)
+        self._od = library.component_od32(path)
+
+    @property
+    def wavelength(self):
+        return self._spectrum[:,0]
+
+    @property
+    def transmission(self):
+        return self._spectrum[:,1]
+
+    @property
+    def od(self):
+        return self._od
+
+    @property
+    def data(self):
+        """ DataFrame view of the spectrum, built on demand"""
+        import pandas as pd
+        return pd.DataFrame(data=self._spectrum,columns=COMPONENT_COLUMNS,copy=False)
+
+    @property
+    def lambda_range(self):
+        return self.wavelength
+
+    def od_at(self,wavelength):
+        """ OD of the element on the given wavelength axis, resampled once per axis and shared by all sessions.
+        Tilted elements are shifted on every call"""
+        if self.angle:
+            return self.od_at_angles(wavelength,[self.angle])[0]
+        od = get_library().resampled_od(self.path,wavelength)
+        if self.name == 'Fiber' and self.length != 1:
+            od = self.length * od
+        return od
+
+    def od_at_angles(self,wavelength,angles):
+        """ (n_angles x n_wavelengths) OD of the element tilted to each angle (degrees)"""
+        angles = np.ravel(np.asarray(angles,dtype=float))
+        normal = angles == 0
+        od = np.empty((len(angles),len(wavelength)))
+        # normal incidence is the cached OD every untilted element uses
+        od[normal] = get_library().resampled_od(self.path,wavelength)
+        od[~normal] = od_at_angles(self.wavelength,self._spectrum[:,2],wavelength,angles[~normal],self.n_eff)
+        if self.name == 'Fiber' and self.length != 1:
+            od = self.length * od
+        return od
 
     def propagate(self,P_in):
-        P_out = P_in.copy()
         # P_in is a dataframe with lambda and 'count' values
-        lambda_max = np.max(P_out['Wavelength'],axis=None)
-        lambda_min = np.min(P_out['Wavelength'],axis=None)
-
-        lambda_slice = self.data[(self.data['Wavelength'] >= lambda_min) & (self.data['Wavelength'] <= lambda_max)]
-        lambda_arr = lambda_slice['Wavelength'].to_numpy()
-        trans_arr =  lambda_slice['Transmission'].to_numpy()
-        od_arr = lambda_slice['od'].to_numpy()
-
-        # pad with a zeros if laser lambda range is bigger than component range
-        if lambda_max > np.max(self.data['Wavelength']):
-            lambda_arr = np.append(lambda_arr,lambda_max)
-            trans_arr = np.append(trans_arr,0)
-            od_arr = np.append(od_arr,0)
-        
-        if lambda_min < np.min(self.data['Wavelength']):
-            lambda_arr = np.insert(lambda_arr,0,lambda_min)
-            trans_arr = np.insert(trans_arr,0,0)
-            od_arr = np.insert(od_arr,0,0)
-
-        # interpolate
-        trans = interp1d(lambda_arr,trans_arr,kind='cubic',fill_value='extrapolate')
-        od = interp1d(lambda_arr,od_arr,kind='cubic',fill_value='extrapolate')
-
-        if self.name == 'Fiber':
-            P_out['sum_norm_counts'] = P_in['sum_norm_counts'].to_numpy() * np.power(10,-(L*od(P_in['Wavelength'].to_numpy())))
-        else:
-            P_out['sum_norm_counts'] = P_in['sum_norm_counts'].to_numpy() * np.power(10,-od(P_in['Wavelength'].to_numpy()))
-
-
-
+        P_out = P_in.copy()
+        od = self.od_at(P_in['Wavelength'].to_numpy())
+        P_out['sum_norm_counts'] = propagate_counts(P_in['sum_norm_counts'].to_numpy(),od)
         return P_out
 
     def make_shape(self):
+        """ Builds the bokeh source and glyphs of the element, only done once it is rendered"""
+        from bokeh.models import ColumnDataSource, Segment, Ellipse
+
         glyphs = []
         if self.name == 'Fiber':
             # make fiber shape _O_
-            src = ColumnDataSource(data = {'x' : [self.pos['x'] - self.shape['w']/2],
-                                           'y' : [self.pos['y'] + self.shape['h']/2],
-                                           'x1': [self.pos['x'] + self.shape['w']/2],
-                                           'y1': [self.pos['y'] + self.shape['h']/2],
-                                           'loop_x' : [self.pos['x']],
-                                           'loop_y' : [self.pos['y'] + self.shape['h']/2 + self.shape['r']],
+            src = ColumnDataSource(data = {'x' : [self.pos[0] - self.shape['w']/2],
+                                           'y' : [self.pos[1] + self.shape['h']/2],
+                                           'x1': [self.pos[0] + self.shape['w']/2],
+                                           'y1': [self.pos[1] + self.shape['h']/2],
+                                           'loop_x' : [self.pos[0]],
+                                           'loop_y' : [self.pos[1] + self.shape['h']/2 + self.shape['r']],
                                            'loop_size' : [self.shape['r']*2],
                                            'color' : [self.color],
                                            'name'  : [self.name]
@@ -104,10 +124,10 @@ class OpticalElement:
                                   fill_alpha=0,
                                   line_width=3))
         else:
-            src = ColumnDataSource(data = {'x':[self.pos['x']],
-                                           'y':[self.pos['y']],
-                                           'x1':[self.pos['x']],
-                                           'y1':[self.pos['y'] + self.shape['h']],
+            src = ColumnDataSource(data = {'x':[self.pos[0]],
+                                           'y':[self.pos[1]],
+                                           'x1':[self.pos[0]],
+                                           'y1':[self.pos[1] + self.shape['h']],
                                            'color':[self.color],
                                            'name':[self.name]})
             # make filter shape |
@@ -119,8 +139,20 @@ class OpticalElement:
                                     line_dash='solid',
                                     line_width=3))
         self.is_active = True
-        self.shape_source = src  
-        self.shape_glyph = glyphs
+        self._shape_source = src
+        self._shape_glyph = glyphs
+
+    @property
+    def shape_source(self):
+        if self._shape_source is None:
+            self.make_shape()
+        return self._shape_source
+
+    @property
+    def shape_glyph(self):
+        if self._shape_glyph is None:
+            self.make_shape()
+        return self._shape_glyph
 
     def remove_shape(self):
         # update glyphs
@@ -141,32 +173,24 @@ class OpticalElement:
         self.shape_source.data = new_src
 
     def move_shape(self,new_pos):
-        """ Moves the shape bu updating the pos dict and then filling the columndatasource for glyphs"""
+        """ Moves the shape bu updating the pos and then filling the columndatasource for glyphs"""
         if not isinstance(new_pos,list):
-            self.pos = {'x':new_pos, 'y':0}
+            self.pos = (new_pos,0)
         else:
-            self.pos = {'x':new_pos[0], 'y':new_pos[1]}
+            self.pos = (new_pos[0],new_pos[1])
 
         # update glyphs
         if self.name == 'Fiber':
-            new_src = {'x' : [self.pos['x']],
-                       'y' : [self.pos['y']],
-                       'x1': [self.pos['x'] + self.shape['w']],
-                       'y1': [self.pos['y'] + self.shape['h']],
+            new_src = {'x' : [self.pos[0]],
+                       'y' : [self.pos[1]],
+                       'x1': [self.pos[0] + self.shape['w']],
+                       'y1': [self.pos[1] + self.shape['h']],
                        'loop_x' : [self.shape['w']/2],
                        'loop_y' : [self.shape['h']/2 + self.shape['r']],
                        'loop_size' : [self.shape['r']*2]}
         else:
-            new_src = {'x':[self.pos['x']],
-                       'y':[self.pos['y']],
-                       'x1':[self.pos['x'] + self.shape['w']],
-                       'y1':[self.pos['y'] + self.shape['h']]}
+            new_src = {'x':[self.pos[0]],
+                       'y':[self.pos[1]],
+                       'x1':[self.pos[0] + self.shape['w']],
+                       'y1':[self.pos[1] + self.shape['h']]}
         self.shape_source.data = new_src
-
-    def set_lambda_range(self,wavelength=None):
-        """ Get the current object properties dependig on the wavelength range"""
-        if wavelength is not None: 
-            self.lambda_range = self.data[(self.data['Wavelength'] >= wavelength[0]) & (self.data['Wavelength'] <= wavelength[1])]
-        else:
-            self.lambda_range = np.arange(300,1200,0.2)
-        
\ No newline at end of file
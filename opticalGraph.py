@@ -0,0 +1,182 @@
+""" Branching optical paths. A beam splitter (e.g. a dichroic) sends T = 10^-OD of its input down the
+transmitted arm and R = 1 - T down the reflected arm, so one laser can feed several samples.
+
+    graph = OpticalGraph(wavelength)
+    graph.add_element('ex',OpticalElement(...))                        # after the laser
+    graph.add_splitter('di',OpticalElement(...),parent='ex')
+    graph.add_element('em',OpticalElement(...),parent=('di','r'))
+    graph.add_sample('camera',parent='em',distance=3)
+    graph.add_sample('monitor',parent=('di','t'))
+    graph.propagate(counts)   # {'camera': counts, 'monitor': counts}
+
+Headless, from component names: sweep.split_power or python sample_power.py --splitter (see README).
+
+Nodes are evaluated in topological order and the transmission at the output of every node is cached,
+so the shared trunk is computed once for all branches and a change only recomputes the nodes downstream of it.
+A node with several parents adds up their (incoherent) outputs.
+"""
+import threading
+
+import numpy as np
+
+from instrumentation import stage
+from propagation import wavelength_key, power_from_counts
+
+SOURCE = 'laser'
+TRANSMITTED = 't'
+REFLECTED = 'r'
+
+
+class _Node:
+    __slots__ = ('kind','element','parents','distance')
+
+    def __init__(self,kind,element,parents,distance=1):
+        self.kind = kind
+        self.element = element
+        self.parents = parents
+        self.distance = distance
+
+
+class OpticalGraph:
+    """ DAG of elements, splitters and samples fed by the laser. Parents are given as a node key
+    (transmitted output), a (key, 't'/'r') tuple or a list of those"""
+    def __init__(self,wavelength):
+        self._lock = threading.RLock()
+        self.nodes = {}
+        self.children = {SOURCE:[]}
+        self.wavelength = np.asarray(wavelength)
+        self._wavelength_key = wavelength_key(self.wavelength)
+        # node key -> {arm: transmission from the laser to that output}
+        self._cache = {}
+
+    def __len__(self):
+        return len(self.nodes)
+
+    def set_wavelength(self,wavelength):
+        """ Changes the wavelength axis (e.g. new laser), cache is kept if the axis is the same"""
+        key = wavelength_key(wavelength)
+        with self._lock:
+            if key != self._wavelength_key:
+                self.wavelength = np.asarray(wavelength)
+                self._wavelength_key = key
+                self._cache.clear()
+
+    def _parse_parents(self,parent):
+        if parent is None:
+            parent = SOURCE
+        parents = parent if isinstance(parent,list) else [parent]
+        parsed = []
+        for p in parents:
+            key,arm = p if isinstance(p,tuple) else (p,TRANSMITTED)
+            if key != SOURCE and key not in self.nodes:
+                raise KeyError('Unknown parent node: {0}'.format(key))
+            if arm == REFLECTED and (key == SOURCE or self.nodes[key].kind != 'splitter'):
+                raise ValueError('Only splitters have a reflected arm: {0}'.format(key))
+            if key != SOURCE and self.nodes[key].kind == 'sample':
+                raise ValueError('Samples are end points: {0}'.format(key))
+            parsed.append((key,arm))
+        return parsed
+
+    def _add(self,key,kind,element,parent,distance=1):
+        with self._lock:
+            if key in self.nodes or key == SOURCE:
+                raise KeyError('Node already exists: {0}'.format(key))
+            parents = self._parse_parents(parent)
+            self.nodes[key] = _Node(kind,element,parents,distance)
+            self.children[key] = []
+            for p,_ in parents:
+                self.children[p].append(key)
+        return key
+
+    def add_element(self,key,element,parent=None):
+        return self._add(key,'element',element,parent)
+
+    def add_splitter(self,key,element,parent=None):
+        """ Element whose transmission goes down the 't' arm and reflection (1 - T) down the 'r' arm"""
+        return self._add(key,'splitter',element,parent)
+
+    def add_sample(self,key,parent=None,distance=1):
+        return self._add(key,'sample',None,parent,distance)
+
+    def descendants(self,key):
+        """ Nodes downstream of key (including key)"""
+        seen = [key]
+        for k in seen:
+            seen.extend(c for c in self.children[k] if c not in seen)
+        return seen
+
+    def invalidate(self,key):
+        """ Drops the cached transmissions of key and everything downstream of it"""
+        with self._lock:
+            for k in self.descendants(key):
+                self._cache.pop(k,None)
+
+    def set_distance(self,key,distance):
+        with self._lock:
+            self.nodes[key].distance = distance
+
+    def remove(self,key):
+        """ Removes a node and everything downstream of it"""
+        with self._lock:
+            removed = self.descendants(key)
+            for k in removed:
+                self._cache.pop(k,None)
+                for p,_ in self.nodes[k].parents:
+                    if p not in removed:
+                        self.children[p] = [c for c in self.children[p] if c != k]
+            for k in removed:
+                self.nodes.pop(k)
+                self.children.pop(k)
+            return removed
+
+    def order(self):
+        """ Node keys in topological order"""
+        with self._lock:
+            n_parents = {k:len(n.parents) for k,n in self.nodes.items()}
+            ready = [SOURCE]
+            order = []
+            while ready:
+                k = ready.pop(0)
+                if k != SOURCE:
+                    order.append(k)
+                for c in self.children[k]:
+                    n_parents[c] -= 1
+                    if not n_parents[c]:
+                        ready.append(c)
+            return order
+
+    def transmissions(self):
+        """ {node: {arm: transmission}} from the laser to each node output, only uncached nodes are computed"""
+        with self._lock:
+            missing = [k for k in self.order() if k not in self._cache]
+            if missing:
+                with stage('propagate'):
+                    ones = np.ones_like(self.wavelength,dtype=float)
+                    for k in missing:
+                        node = self.nodes[k]
+                        t_in = sum(ones if p == SOURCE else self._cache[p][arm] for p,arm in node.parents)
+                        if node.kind == 'sample':
+                            self._cache[k] = {TRANSMITTED:t_in}
+                            continue
+                        t = np.power(10,-node.element.od_at(self.wavelength))
+                        if node.kind == 'splitter':
+                            # measured OD can be slightly negative (T > 1), R = 1 - T must stay positive
+                            t = np.clip(t,0,1)
+                            self._cache[k] = {TRANSMITTED:t_in * t,REFLECTED:t_in * (1 - t)}
+                        else:
+                            self._cache[k] = {TRANSMITTED:t_in * t}
+            return self._cache
+
+    def samples(self):
+        return [k for k,n in self.nodes.items() if n.kind == 'sample']
+
+    def propagate(self,counts):
+        """ Counts at every sample, with its 1/d² distance term"""
+        cache = self.transmissions()
+        counts = np.asarray(counts)
+        with stage('distance'):
+            return {k:counts * cache[k][TRANSMITTED] / (self.nodes[k].distance**2) for k in self.samples()}
+
+    def powers(self,counts):
+        """ Power at every sample"""
+        return {k:float(power_from_counts(self.wavelength,c)) for k,c in self.propagate(counts).items()}
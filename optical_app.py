@@ -1,14 +1,25 @@
+from functools import partial
+
 import numpy as np 
-import pandas as pd
-from scipy.stats import norm
 
 from bokeh.io import show,curdoc
 from bokeh.plotting import figure
-from bokeh.palettes import Set1
+from bokeh.palettes import Set1, Viridis256
+from bokeh.events import RangesUpdate
 from bokeh.layouts import row, column
-from bokeh.models import Plot, Segment, ColumnDataSource, Select, RadioButtonGroup, CheckboxButtonGroup, MultiSelect, RangeSlider, Button, Slider, DataTable, Segment, Div, Tabs, Panel, TableColumn, PreText, FileInput, HoverTool
+from bokeh.models import Plot, Segment, ColumnDataSource, Select, RadioButtonGroup, CheckboxButtonGroup, MultiSelect, RangeSlider, Button, Slider, DataTable, Segment, Div, Tabs, Panel, TableColumn, PreText, FileInput, HoverTool, TextInput, Toggle, LinearColorMapper, ColorBar
 
 from opticalElement import OpticalElement
+from spectralLibrary import load_shared_store, component_path_lookup, laser_path_lookup
+from propagation import OpticalChain, power_from_counts, wavelength_key
+from rendering import ChainRenderer, DecimatedLine
+from jobs import CoalescingRunner
+from streaming import SpectrometerStream, open_source, frame_counts
+from resultsCache import get_results_cache, config_key
+from catalog import get_catalog
+from incidence import tilt_sweep
+import instrumentation
+from instrumentation import timed
 
 #####################################
 # GLOBAL VARIABLES AND DATA SOURCES #
@@ -16,40 +27,44 @@ from opticalElement import OpticalElement
 # Color palette to iterate over with every new component added
 clr = Set1[9]
 
-# Measured knob powers to be used in 
-knob_power_lookup = {}
-
-# csv data paths for components
-component_path_lookup = {'Thorlabs 450/10' : 'csv_data/thorlabs/FB450-10_Spectrum.csv',
-                         'Thorlabs 450 LP' : 'csv_data/thorlabs/FEL0450_Spectrum.csv',
-                         'Semrock 468 SP'  : 'csv_data/semrock/FF01-468_SP_Spectrum.csv',
-                         'Semrock 460/14'  : 'csv_data/semrock/FF01-460-14_Spectrum.csv',
-                         'Semrock 442 LP'  : 'csv_data/semrock/BLP01-442R_Spectrum.csv',
-                         'Semrock 430 LP'  : 'csv_data/semrock/FF01-430_LP_Spectrum.csv',
-                         'Fiber'           : 'Fiber'} 
-
-laser_path_lookup = {'445nm Blue'  : 'csv_data/laser/no_filter_laser.csv',
-                     '540nm Green' : 'csv_data/laser/single_filter_laser.csv'}
+# knob, component and laser lookups live in spectralLibrary so headless code can use them too
+# spectra are loaded once per server process and shared by all sessions
+library = load_shared_store(component_path_lookup,laser_path_lookup)
 
 def get_laser_data(laser_name):
-    laser_path = laser_path_lookup[laser_name]
-    laser_data = pd.read_csv(laser_path,sep='\t')
-    # clean and normalize
-    laser_data['Counts'] = laser_data['Counts'].apply(lambda x: 0 if x<0 else x)
-
-    laser_data['max_norm_counts'] = (laser_data['Counts'] / np.max(laser_data['Counts'],axis=None))
-    laser_data['sum_norm_counts'] = (laser_data['Counts'] / np.sum(laser_data['Counts'],axis=None))
-    return laser_data
+    return library.laser(laser_path_lookup[laser_name])
 
-comps = [k for k in component_path_lookup.keys()]
+# every part of the vendor directories, spectra of the ones outside component_path_lookup load when added
+catalog = get_catalog()
+comps = list(catalog.names.keys())
 
 # global sync stuff
-active_components = {}
+doc = curdoc()
+# propagation runs off the bokeh thread when served, inline otherwise (e.g. scripts)
+job_runner = CoalescingRunner(doc,synchronous=doc.session_context is None)
+# tilt sweeps coalesce on their own, they must not replace a queued propagation
+tilt_runner = CoalescingRunner(doc,synchronous=doc.session_context is None)
 component_keys = {}
 component_ctr = 1
-the_laser = get_laser_data('445nm Blue')
+the_laser_name = '445nm Blue'
+the_laser = get_laser_data(the_laser_name)
+# the chain caches the transmission after each component
+the_chain = OpticalChain(the_laser['Wavelength'].to_numpy())
+active_components = the_chain.elements
 the_distance = 1
 the_power = 0
+# propagated spectra of configurations already seen, shared by all sessions
+results_cache = get_results_cache()
+# live spectrometer stream, replaces the_laser counts while running
+the_stream = None
+stream_callback = None
+last_frame = 0
+STREAM_ROLLOVER = 2000
+# tilt sweep of the selected component, the heatmap is resampled to TILT_PIXELS wavelengths
+TILT_ANGLES = np.arange(0,61,1)
+TILT_PIXELS = 700
+# inputs of the shown sweep, it does not depend on the tilt of the selected component itself
+tilt_sweep_key = None
 
 # init sources
 component_specs = {'Wavelength':[],
@@ -68,11 +83,7 @@ optical_path = {'x':[0],
 
 sources = {}
 sources['spec_src'] = ColumnDataSource(data = component_specs)
-sources['transmission_src'] = ColumnDataSource(data = component_specs)
-sources['od_src'] = ColumnDataSource(data = component_specs)
-sources['laser_src'] = ColumnDataSource(data = the_laser.to_dict(orient='list'))
 sources['optical_path_src'] = ColumnDataSource(data = optical_path)
-sources['power_src'] = ColumnDataSource(data = the_laser.to_dict(orient='list'))
 
 #########
 # UI/UX #
@@ -86,6 +97,9 @@ laser_selector = RadioButtonGroup(labels=[k for k in laser_path_lookup.keys()],a
 distance_slider = Slider(start=1,end=20,value=the_distance,step=1,title='Distance(mm)')
 knob_slider = Slider(start=0,end=10,step=0.1,value=0,title='Knob Value')
 component_select = Select(title='Available Components',options=comps,value=comps[0]) #this gives the value as a string name
+component_search = TextInput(title='Search components',placeholder='e.g. FF01 or Di')
+pass_filter = TextInput(title='Passes (nm)',placeholder='e.g. 450 or 440-460')
+block_filter = TextInput(title='Blocks (nm)',placeholder='e.g. 500-600')
 add_component = Button(label='Add Component',button_type='success')
 remove_component = Button(label='Remove Component',button_type='warning')
 
@@ -94,6 +108,10 @@ component_list = MultiSelect(options=list(component_keys.values())) #this gives
 selected_component_data = DataTable(source=sources['spec_src'],columns=columns,width=400, height=250)
 power_div = Div(text="""<h2> Sample at {0} mm:<b>{1} mW/mm²</b></h2>""".format(the_distance,the_power))
 log_text = PreText(text=""" """,width=400,height=300)
+stream_source = TextInput(title='Spectrometer source (file:, pipe: or udp:host:port)',value='udp:127.0.0.1:5005')
+stream_rate = Slider(start=1,end=50,value=20,step=1,title='Stream rate(Hz)')
+stream_toggle = Toggle(label='Stream Laser',button_type='primary')
+tilt_slider = Slider(start=0,end=60,value=0,step=0.5,title='Tilt of selected component(deg)')
 
 # optical path plot
 path_plot = figure(plot_width=700,plot_height=200,toolbar_location='below')
@@ -108,6 +126,10 @@ path_plot.grid.visible = False
 
 # transmission/od plot
 transmission_plot = figure(plot_width=700,plot_height=300,toolbar_location='below')
+# laser and power curves are decimated to the plot width, see rendering.py
+laser_line = DecimatedLine(transmission_plot,'Wavelength','max_norm_counts')
+laser_line.set_data(the_laser['Wavelength'],the_laser['max_norm_counts'])
+sources['laser_src'] = laser_line.source
 transmission_plot.line(x='Wavelength',y='max_norm_counts',line_width=3,line_color='#0000ff',source=sources['laser_src'])
 transmission_plot.xaxis.axis_label = 'Wavelength(nm)'
 transmission_plot.yaxis.axis_label = 'Transmission'
@@ -115,11 +137,48 @@ od_plot = figure(plot_width=700,plot_height=300,toolbar_location='below')
 od_plot.xaxis.axis_label = 'Wavelength(nm)'
 od_plot.yaxis.axis_label = 'Optical Density'
 
+# component spectra and glyphs, renderers are created only once
+chain_renderer = ChainRenderer(path_plot,transmission_plot,od_plot,sources['optical_path_src'])
+sources['transmission_src'] = chain_renderer.transmission_src
+sources['od_src'] = chain_renderer.od_src
+
 tab1 = Panel(child=transmission_plot,title='Transmission')
 tab2 = Panel(child=od_plot,title='Optical Density')
 
+# per callback/stage timings, see instrumentation.py
+diagnostics_text = PreText(text=instrumentation.report(),width=700,height=300)
+export_timings = Button(label='Export Timings',button_type='default')
+tab3 = Panel(child=column(diagnostics_text,export_timings),title='Diagnostics')
+
+# power on sample over time while streaming
+sources['power_trace_src'] = ColumnDataSource(data={'time':[],'power':[]})
+trace_plot = figure(plot_width=700,plot_height=300,toolbar_location='below',x_axis_type='datetime')
+trace_plot.line(x='time',y='power',line_width=2,line_color='#0f8bdd',source=sources['power_trace_src'])
+trace_plot.xaxis.axis_label = 'Time'
+trace_plot.yaxis.axis_label = 'Power on sample(mW/mm²)'
+tab4 = Panel(child=column(row(stream_source,stream_rate),stream_toggle,trace_plot),title='Live Power')
+
+# counts at the sample while the selected component is tilted through TILT_ANGLES
+sources['tilt_src'] = ColumnDataSource(data={'image':[],'x':[],'y':[],'dw':[],'dh':[]})
+sources['tilt_power_src'] = ColumnDataSource(data={'angle':[],'power':[]})
+tilt_mapper = LinearColorMapper(palette=Viridis256)
+tilt_plot = figure(plot_width=700,plot_height=300,toolbar_location='below')
+tilt_plot.image(image='image',x='x',y='y',dw='dw',dh='dh',color_mapper=tilt_mapper,source=sources['tilt_src'])
+tilt_plot.add_layout(ColorBar(color_mapper=tilt_mapper,width=8),'right')
+tilt_plot.xaxis.axis_label = 'Wavelength(nm)'
+tilt_plot.yaxis.axis_label = 'Angle of incidence(deg)'
+tilt_power_plot = figure(plot_width=700,plot_height=200,toolbar_location='below')
+tilt_power_plot.line(x='angle',y='power',line_width=2,line_color='#0f8bdd',source=sources['tilt_power_src'])
+tilt_power_plot.xaxis.axis_label = 'Angle of incidence(deg)'
+tilt_power_plot.yaxis.axis_label = 'Power on sample(mW/mm²)'
+tab5 = Panel(child=column(tilt_slider,tilt_plot,tilt_power_plot),title='Tilt')
+plot_tabs = Tabs(tabs=[tab1,tab2,tab3,tab4,tab5])
+
 #power plot
 power_plot = figure(plot_width=500,plot_height=500,toolbar_location='below')
+power_line = DecimatedLine(power_plot,'Wavelength','sum_norm_counts')
+power_line.set_data(the_laser['Wavelength'],the_laser['sum_norm_counts'])
+sources['power_src'] = power_line.source
 power_plot.line(x='Wavelength',y='sum_norm_counts',line_width=3,line_color='#0f8bdd',source=sources['power_src'])
 power_plot.xaxis.axis_label = 'Wavelength(nm)'
 power_plot.yaxis.axis_label = 'Relative Power'
@@ -147,108 +206,92 @@ power_plot.add_tools(HoverTool(tooltips=[('Power','$y'),
 # CALLBACKS AND FUNCTIONS #
 ###########################
 def calc_power(power_frame):
-    energy_arr = 1.2398 / power_frame['Wavelength'].to_numpy()
-    return float(np.sum(energy_arr * power_frame['sum_norm_counts'],axis=None))
+    return float(power_from_counts(power_frame['Wavelength'].to_numpy(),power_frame['sum_norm_counts'].to_numpy()))
 
-def update_plots_and_propagate_light():
-    global the_laser
-    P_temp = the_laser
-
-    #clear plot sources
-    sources['transmission_src'].data = {'Wavelength':[[]],
-                                        'Transmission':[[]],
-                                        'od':[[]],
-                                        'color':[[]],
-                                        'name':[[]]}
-
-    sources['od_src'].data = {'Wavelength':[[]],
-                              'Transmission':[[]],
-                              'od':[[]],
-                              'color':[[]],
-                              'name':[[]]}
-
-    sources['optical_path_src'].data = {'x':[0],
-                                        'y':[0],
-                                        'x1':[0],
-                                        'y1':[0],
-                                        'color':['#e885fc'],
-                                        'beam_w':[float(knob_slider.value)],
-                                        'name':['Sample']}
-
-    # update plot sources and propagate light through existing components
-    for comp in active_components.values():
-        for k in sources['transmission_src'].data.keys():
-            if k == 'color':
-                sources['transmission_src'].data['color'].append(comp.color)
-                sources['od_src'].data['color'].append(comp.color)
-            elif k == 'name':
-                sources['transmission_src'].data['name'].append(comp.name)
-                sources['od_src'].data['name'].append(comp.name)
-            else:
-                sources['transmission_src'].data[k].append(comp.data[k].tolist())
-                sources['od_src'].data[k].append(comp.data[k].tolist())
-        for g in comp.shape_glyph:
-            path_plot.add_glyph(source_or_glyph=comp.shape_source,glyph=g)
-
-        # propagate the_laser here with all the wavelengths
-        P_temp = comp.propagate(P_temp)
-
-    # propagate distance
-    P_temp['sum_norm_counts'] = P_temp['sum_norm_counts'].apply(lambda x: x * (1/(the_distance**2)))
-
-    sources['optical_path_src'].data = {'x':[component_ctr+the_distance],
-                                        'y':[-1],
-                                        'x1':[component_ctr+the_distance],
-                                        'y1':[1],
-                                        'color':['#e885fc'],
-                                        'beam_w':[float(knob_slider.value)],
-                                        'name':['Sample']}
-
-    sources['power_src'].data = P_temp.to_dict(orient='list')
-
-    the_power = calc_power(P_temp)
-    # Update plots and UI stuff
-    power_div.text = """<h1>Power on sample at {0} mm: <b><br/>{1} mW/mm²</b></h1>""".format(the_distance,the_power)
-        
-    transmission_plot.multi_line(xs='Wavelength',ys='Transmission',line_color='color',line_dash='dashed',source=sources['transmission_src'])
-    od_plot.multi_line(xs='Wavelength',ys='od',line_color='color',source=sources['od_src'])
+@timed('job.compute_power')
+def compute_power(laser,laser_name,distance,knob):
+    """ Propagates the laser through the cached chain transmission and the distance, runs off the bokeh thread.
+    Configurations already in the results cache are not propagated again. Keys are built from the chain
+    configuration read inside the job, so changes made while the job was queued cannot be cached under it"""
+    laser_path = laser_path_lookup[laser_name]
+    P_temp = laser.copy()
+    components,fiber_length,_ = the_chain.configuration()
+    cached = results_cache.get(config_key(laser_path,components,fiber_length,distance,knob))
+    if cached is not None:
+        P_temp['sum_norm_counts'],power = cached
+        return P_temp,distance,power
+    counts,(components,fiber_length,axis) = the_chain.propagate_with_configuration(laser['sum_norm_counts'].to_numpy(),distance)
+    P_temp['sum_norm_counts'] = counts
+    power = calc_power(P_temp)
+    # the chain may already be on the axis of a newer laser, do not cache a mix of the two
+    if axis == wavelength_key(laser['Wavelength'].to_numpy()):
+        results_cache.put(config_key(laser_path,components,fiber_length,distance,knob),counts,power)
+    return P_temp,distance,power
+
+@timed('job.apply_power')
+def apply_power(result):
+    global the_power
+    P_temp,distance,the_power = result
+    power_line.set_data(P_temp['Wavelength'],P_temp['sum_norm_counts'])
+    power_div.text = """<h1>Power on sample at {0} mm: <b><br/>{1} mW/mm²</b></h1>""".format(distance,the_power)
+
+def propagate_light():
+    """ Queues the propagation, only the latest request of this session is computed"""
+    job_runner.submit(partial(compute_power,the_laser,the_laser_name,the_distance,float(knob_slider.value)),apply_power)
+
+def update_plots():
+    """ Moves the sample to the end of the chain, component spectra and glyphs are kept up to date by chain_renderer"""
+    chain_renderer.update_sample(component_ctr+the_distance-1,float(knob_slider.value))
 
-    path_plot.segment(x0='x',x1='x1',y0='y',y1='y1',line_width=3,line_color='color',source=sources['optical_path_src'])
+def update_plots_and_propagate_light():
+    update_plots()
+    propagate_light()
+    update_tilt_sweep()
 
+@timed('callback.distance_slider_change')
 def distance_slider_change(attr,old,new):
+    global the_distance
     the_distance = int(distance_slider.value)
-    sources['optical_path_src'].data['x'] = [component_ctr+the_distance-1]
-    sources['optical_path_src'].data['x1'] = [component_ctr+the_distance-1]
-    global the_laser
-    P_temp = the_laser.copy()
-    P_temp['sum_norm_counts'] = P_temp['sum_norm_counts'].apply(lambda x: x * (1/(the_distance**2)))
-    the_power = calc_power(P_temp)
-    power_div.text = """<h1>Power on sample at {0} mm: <b><br/>{1} mW/mm²</b></h1>""".format(the_distance,the_power)
+    update_plots()
+    # only the distance changed, reuse the chain transmission
+    propagate_light()
+    update_tilt_sweep()
     log_text.text = 'Distance set to {0}\n'.format(the_distance)
     
+@timed('callback.knob_slider_change')
 def knob_slider_change(attr,old,new):
-    sources['optical_path_src'].data['beam_w'] = [float(knob_slider.value)]
+    update_plots()
     log_text.text = 'Knob value set to {0}\n'.format(knob_slider.value)
     
 # Buttons
+@timed('callback.laser_radio_button')
 def laser_radio_button(attr):
     laser_keys = list(laser_path_lookup.keys())
     laser_name = laser_keys[int(laser_selector.active)]
-    global the_laser
+    global the_laser, the_laser_name
+    the_laser_name = laser_name
     the_laser = get_laser_data(laser_name)
-    sources['laser_src'].data = the_laser.to_dict(orient='list')
+    the_chain.set_wavelength(the_laser['Wavelength'].to_numpy())
+    laser_line.set_data(the_laser['Wavelength'],the_laser['max_norm_counts'])
+    propagate_light()
+    update_tilt_sweep()
     log_text.text = 'Laser changed {0}\n'.format(laser_name)
     
+@timed('callback.add_button')
 def add_button():
     global component_ctr
     selected = component_select.value 
+    if selected not in catalog.names:
+        return
     log_text.text = 'Added {0}\n'.format(selected)
 
     # add the OpticalElement object to the dictionary
     key = '{0}_{1}'.format(selected,component_ctr)
-    active_components[key] = OpticalElement(name=selected,pos=component_ctr,
-                                            csv_path=component_path_lookup[selected],
-                                            color=clr[len(clr)%component_ctr])
+    comp = OpticalElement(name=selected,pos=component_ctr,
+                          csv_path=catalog.path(selected),
+                          color=clr[component_ctr%len(clr)])
+    the_chain.append(key,comp)
+    chain_renderer.add_component(key,comp)
     # add key 
     component_keys[str(component_ctr)] = (str(component_ctr),key)
     # update the shown component list
@@ -257,15 +300,15 @@ def add_button():
     
     update_plots_and_propagate_light()
     
+@timed('callback.remove_button')
 def remove_button():
     selected = component_list.value
     if len(selected):
         global component_ctr
         for comp_id in selected:
             comp_name = component_keys[comp_id][1]
-            comp = active_components[comp_name]
-            comp.remove_shape()
-            active_components.pop(comp_name)
+            chain_renderer.remove_component(comp_name)
+            the_chain.remove(comp_name)
             component_keys.pop(comp_id)
             log_text.text = 'Removed {0}\n'.format(comp_name)
             component_ctr -= 1
@@ -275,38 +318,203 @@ def remove_button():
 
     print(component_list)
 
+def parse_band(text):
+    """ '450' -> 450, '440-460' -> (440, 460), empty -> None"""
+    text = text.strip()
+    if not text:
+        return None
+    values = [float(v) for v in text.replace(',','-').split('-') if v.strip()]
+    return values[0] if len(values) == 1 else (min(values),max(values))
+
+@timed('callback.component_filter_change')
+def component_filter_change(attr,old,new):
+    """ Narrows the component selector down to the catalog parts matching the search and band filters"""
+    try:
+        passes = parse_band(pass_filter.value)
+        blocks = parse_band(block_filter.value)
+    except ValueError:
+        log_text.text = 'Bands are given as 450 or 440-460\n'
+        return
+    found = catalog.search(component_search.value,passes=passes,blocks=blocks)
+    component_select.options = found
+    if component_select.value not in found:
+        component_select.value = found[0] if len(found) else ''
+    log_text.text = '{0} matching components\n'.format(len(found))
+
+@timed('callback.transmission_range_change')
+def transmission_range_change(event):
+    # refine the decimated curves for the zoomed view
+    chain_renderer.refine_transmission()
+    laser_line.refine()
+
+@timed('callback.od_range_change')
+def od_range_change(event):
+    chain_renderer.refine_od()
+
+@timed('callback.power_range_change')
+def power_range_change(event):
+    power_line.refine()
+
+@timed('callback.multiselect_select')
 def multiselect_select(attr,old,new):
     selected = component_list.value
     # always show the first one
     selected = selected[0]
 
-    selected_data = active_components[component_keys[selected][1]].data
-    temp = {}
-    for c in selected_data.columns:
-        temp[c] = selected_data[c].tolist()
-    sources['spec_src'].data = temp
+    comp = active_components[component_keys[selected][1]]
+    sources['spec_src'].data = {'Wavelength':comp.wavelength.astype(np.float32),
+                                'Transmission':comp.transmission.astype(np.float32),
+                                'od':comp.od}
+    tilt_slider.value = comp.angle
+    update_tilt_sweep()
     print(component_list.value,flush=True)
 
+def selected_key():
+    """ Chain key of the first selected component, None if nothing is selected"""
+    selected = component_list.value
+    if not len(selected) or selected[0] not in component_keys:
+        return None
+    return component_keys[selected[0]][1]
+
+@timed('job.compute_tilt_sweep')
+def compute_tilt_sweep(elements,index,laser,distance,sweep_key):
+    """ Counts and power at the sample for every tilt of the selected component in one broadcast call,
+    runs off the bokeh thread"""
+    wavelength = laser['Wavelength'].to_numpy()
+    angles,counts,power = tilt_sweep(elements,index,laser['sum_norm_counts'].to_numpy(),wavelength,TILT_ANGLES,distance)
+    # images need an evenly spaced axis, the spectrometer axis is not
+    grid = np.linspace(wavelength[0],wavelength[-1],TILT_PIXELS)
+    j = np.clip(np.searchsorted(wavelength,grid),1,len(wavelength)-1)
+    frac = (grid - wavelength[j-1]) / (wavelength[j] - wavelength[j-1])
+    image = counts[:,j-1] * (1 - frac) + counts[:,j] * frac
+    return angles,grid,image.astype(np.float32),power.astype(np.float32),sweep_key
+
+@timed('job.apply_tilt_sweep')
+def apply_tilt_sweep(result):
+    global tilt_sweep_key
+    angles,grid,image,power,tilt_sweep_key = result
+    sources['tilt_src'].data = {'image':[image],'x':[grid[0]],'y':[angles[0]],
+                                'dw':[grid[-1]-grid[0]],'dh':[angles[-1]-angles[0]]}
+    sources['tilt_power_src'].data = {'angle':angles.astype(np.float32),'power':power}
+
+def update_tilt_sweep():
+    """ Queues the tilt sweep of the selected component when the Tilt tab is shown and its inputs
+    (selection, the rest of the chain, laser, distance) changed since the last one"""
+    key = selected_key()
+    if key is None or plot_tabs.active != plot_tabs.tabs.index(tab5):
+        return
+    index = list(active_components.keys()).index(key)
+    components,fiber_length,axis = the_chain.configuration()
+    sweep_key = (key,tuple(c for i,c in enumerate(components) if i != index),fiber_length,the_laser_name,axis,the_distance)
+    if sweep_key == tilt_sweep_key:
+        return
+    tilt_runner.submit(partial(compute_tilt_sweep,list(active_components.values()),index,the_laser,the_distance,sweep_key),
+                       apply_tilt_sweep)
+
+@timed('callback.tilt_slider_change')
+def tilt_slider_change(attr,old,new):
+    key = selected_key()
+    if key is None or active_components[key].angle == tilt_slider.value:
+        return
+    the_chain.set_angle(key,tilt_slider.value)
+    propagate_light()
+    log_text.text = '{0} tilted to {1} deg\n'.format(key,tilt_slider.value)
+
+def plot_tabs_change(attr,old,new):
+    if new == plot_tabs.tabs.index(tab5):
+        update_tilt_sweep()
+
+@timed('callback.stream_tick')
+def stream_tick():
+    """ Propagates the newest spectrometer frame through the cached chain transmission"""
+    global last_frame, the_power
+    latest = the_stream.buffer.latest()
+    if latest is None or latest[2] == last_frame:
+        return
+    timestamp,frame,last_frame = latest
+    wavelength = the_laser['Wavelength'].to_numpy()
+    counts = the_chain.propagate(frame_counts(frame,the_laser['Counts'].sum()),the_distance)
+    the_power = float(power_from_counts(wavelength,counts))
+    power_line.set_data(wavelength,counts)
+    sources['power_trace_src'].stream({'time':[timestamp*1000],'power':[the_power]},rollover=STREAM_ROLLOVER)
+    power_div.text = """<h1>Power on sample at {0} mm: <b><br/>{1} mW/mm²</b></h1>""".format(the_distance,the_power)
+
+def stop_stream():
+    global the_stream, stream_callback
+    if stream_callback is not None:
+        doc.remove_periodic_callback(stream_callback)
+        stream_callback = None
+    if the_stream is not None:
+        the_stream.stop()
+        log_text.text = 'Stream stopped, {0} frames ({1} dropped)\n'.format(the_stream.buffer.count,the_stream.dropped)
+        the_stream = None
+
+def stream_toggle_change(attr,old,new):
+    global the_stream, stream_callback
+    stop_stream()
+    if stream_toggle.active:
+        try:
+            source = open_source(stream_source.value)
+        except (OSError,ValueError) as e:
+            log_text.text = 'Could not open {0}: {1}\n'.format(stream_source.value,e)
+            stream_toggle.active = False
+            return
+        the_stream = SpectrometerStream(source,len(the_laser)).start()
+        stream_callback = doc.add_periodic_callback(stream_tick,int(1000/stream_rate.value))
+        log_text.text = 'Streaming from {0}\n'.format(stream_source.value)
+    else:
+        # back to the static laser spectrum
+        propagate_light()
+
+def stream_rate_change(attr,old,new):
+    global stream_callback
+    if stream_callback is not None:
+        doc.remove_periodic_callback(stream_callback)
+        stream_callback = doc.add_periodic_callback(stream_tick,int(1000/stream_rate.value))
+
+def update_diagnostics():
+    diagnostics_text.text = instrumentation.report()
+
+def export_timings_button():
+    instrumentation.export_json('optopath_timings.json')
+    instrumentation.export_prometheus('optopath_timings.prom')
+    log_text.text = 'Timings exported to optopath_timings.json and optopath_timings.prom\n'
+
 # bind callbacks
+export_timings.on_click(export_timings_button)
+stream_toggle.on_change('active',stream_toggle_change)
+stream_rate.on_change('value',stream_rate_change)
+doc.on_session_destroyed(lambda session_context: stop_stream())
+if instrumentation.is_enabled():
+    doc.add_periodic_callback(update_diagnostics,1000)
 laser_selector.on_click(laser_radio_button)
 distance_slider.on_change('value',distance_slider_change)
 knob_slider.on_change('value',knob_slider_change)
 component_list.on_change('value',multiselect_select)
+# one event per zoom/pan, x_range start and end changes would refine twice
+transmission_plot.on_event(RangesUpdate,transmission_range_change)
+od_plot.on_event(RangesUpdate,od_range_change)
+power_plot.on_event(RangesUpdate,power_range_change)
 add_component.on_click(add_button)
+for widget in [component_search,pass_filter,block_filter]:
+    widget.on_change('value',component_filter_change)
 remove_component.on_click(remove_button)
+tilt_slider.on_change('value',tilt_slider_change)
+plot_tabs.on_change('active',plot_tabs_change)
 
 ##############
 # SET LAYOUT #
 ##############
 layout = column(row(column(laser_selector,
+                           row(component_search,pass_filter,block_filter),
                            row(column(component_select,add_component), # can add log_text in this column
                                column(component_list,remove_component)), 
                            distance_slider,knob_slider),
                            selected_component_data),
-                row(column(path_plot,Tabs(tabs=[tab1,tab2])),
+                row(column(path_plot,plot_tabs),
                     column(power_div,power_plot)))
 
-curdoc().add_root(layout)
+doc.add_root(layout)
 
 
 # elif self.name == 'Distance':
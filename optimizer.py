@@ -0,0 +1,145 @@
+""" Filter set optimizer, searches the component catalog for the chains that give the most in-band
+power at the sample while keeping the out-of-band leakage under a threshold. Does not need bokeh.
+
+    >>> from optimizer import optimize_filters
+    >>> optimize_filters('445nm Blue',band=(440,460),max_leakage=1e-3)
+"""
+import heapq
+
+import numpy as np
+
+from spectralLibrary import get_library, laser_path_lookup
+from catalog import get_catalog
+from sweep import component_od
+from propagation import pool_size, map_jobs
+
+
+def band_integrals(od,band_mask,weight):
+    """ Power weighted mean OD of each component in and out of the band, (n_components x 2)"""
+    w_in = weight * band_mask
+    w_out = weight * ~band_mask
+    return np.column_stack((od @ w_in / max(np.sum(w_in),1e-300),
+                            od @ w_out / max(np.sum(w_out),1e-300)))
+
+
+class _Search:
+    """ Depth first branch and bound over component subsets.
+    In-band power of a subset is an upper bound for all of its supersets and the out-of-band power
+    with every remaining component added is a lower bound, negative ODs are accounted for in both"""
+    def __init__(self,od,band_mask,weight,max_leakage,max_components,top_k):
+        transmission = np.power(10,-od)
+        self.A_in = transmission[:,band_mask]
+        self.A_out = transmission[:,~band_mask]
+        # suffix bounds: what the remaining components can at most give back / at least take away
+        gain = np.cumsum(np.clip(-od,0,None)[::-1],axis=0)[::-1]
+        loss = np.cumsum(np.clip(od,0,None)[::-1],axis=0)[::-1]
+        zeros = np.zeros((1,od.shape[1]))
+        self.G_in = np.power(10,np.vstack((gain,zeros))[:,band_mask])
+        self.L_out = np.power(10,-np.vstack((loss,zeros))[:,~band_mask])
+
+        self.w_in = weight[band_mask]
+        self.w_out = weight[~band_mask]
+        self.max_leak = max_leakage * np.sum(weight)
+        self.max_components = max_components
+        self.top_k = top_k
+        self.n = od.shape[0]
+        self.best = []
+
+    def kth_best(self):
+        return self.best[0][0] if len(self.best) >= self.top_k else -np.inf
+
+    def record(self,p_in,p_out,subset):
+        item = (p_in,-p_out,subset)
+        if len(self.best) < self.top_k:
+            heapq.heappush(self.best,item)
+        elif item > self.best[0]:
+            heapq.heapreplace(self.best,item)
+
+    def expand(self,subset,vec_in,vec_out,start):
+        """ Evaluates every child subset+[j] (j >= start) with one matvec and recurses where the bounds allow"""
+        if start >= self.n or len(subset) >= self.max_components:
+            return
+        p_in = self.A_in[start:] @ vec_in
+        p_out = self.A_out[start:] @ vec_out
+        for k,j in enumerate(range(start,self.n)):
+            if p_out[k] <= self.max_leak:
+                self.record(p_in[k],p_out[k],subset + (j,))
+            if len(subset) + 1 >= self.max_components:
+                continue
+            child_in = vec_in * self.A_in[j]
+            if child_in @ self.G_in[j+1] <= self.kth_best():
+                continue
+            child_out = vec_out * self.A_out[j]
+            if child_out @ self.L_out[j+1] > self.max_leak:
+                continue
+            self.expand(subset + (j,),child_in,child_out,j+1)
+
+    def record_empty(self):
+        p_out = np.sum(self.w_out)
+        if p_out <= self.max_leak:
+            self.record(np.sum(self.w_in),p_out,())
+
+    def run_root(self,j=None):
+        """ Searches the whole tree (j is None, empty chain included) or only the branch starting with component j"""
+        if j is None:
+            self.record_empty()
+            self.expand((),self.w_in,self.w_out,0)
+        else:
+            vec_in = self.w_in * self.A_in[j]
+            vec_out = self.w_out * self.A_out[j]
+            p_out = np.sum(vec_out)
+            if p_out <= self.max_leak:
+                self.record(np.sum(vec_in),p_out,(j,))
+            self.expand((j,),vec_in,vec_out,j+1)
+        return self.best
+
+
+_search = None
+
+def _init_worker(args):
+    global _search
+    _search = _Search(*args)
+
+def _run_branch(j):
+    _search.best = []
+    return _search.run_root(j)
+
+
+def optimize_filters(laser_name,band,max_leakage=1e-3,candidates=None,max_components=3,top_k=10,distance=1,processes=None):
+    """ Ranks the filter subsets of the catalog by in-band power at the sample.
+    band is the (min,max) pass band in nm, max_leakage the allowed out-of-band power as a fraction
+    of the total laser power. Transmissions multiply, so the order of filters within a chain does not
+    change the power and each subset is returned once.
+    Returns a DataFrame with chain, in_band_power and leakage columns, best first"""
+    if candidates is None:
+        candidates = [k for k in get_catalog().names.keys() if k != 'Fiber']
+    candidates = list(candidates)
+
+    laser = get_library().laser_array(laser_path_lookup[laser_name])
+    wavelength = np.ascontiguousarray(laser[:,0])
+    weight = 1.2398 / wavelength * laser[:,3] / (distance**2)
+    band_mask = (wavelength >= band[0]) & (wavelength <= band[1])
+    od = np.vstack([component_od(c,wavelength) for c in candidates]) if len(candidates) else np.zeros((0,len(wavelength)))
+
+    # most promising components first, good solutions early mean more pruning
+    order = np.argsort(band_integrals(od,band_mask,weight)[:,0],kind='stable')
+    od = od[order]
+    names = [candidates[i] for i in order]
+
+    args = (od,band_mask,weight,max_leakage,max_components,top_k)
+    processes = pool_size(len(names),processes)
+    if processes > 1:
+        # the empty chain is cheap, the branches starting with each component are spread over the pool
+        search = _Search(*args)
+        search.record_empty()
+        results = [search.best]
+        results.extend(map_jobs(_run_branch,range(len(names)),processes,initializer=_init_worker,initargs=(args,)))
+    else:
+        results = [_Search(*args).run_root(None)]
+
+    import pandas as pd
+    best = heapq.nlargest(top_k,[item for r in results for item in r])
+    total = np.sum(weight)
+    return pd.DataFrame({'chain':[tuple(names[i] for i in subset) for _,_,subset in best],
+                         'in_band_power':[p_in for p_in,_,_ in best],
+                         'leakage':[-neg_out / total for _,neg_out,_ in best]})
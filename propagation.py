@@ -0,0 +1,185 @@
+import os
+import threading
+
+import numpy as np
+
+from instrumentation import stage
+
+
+def wavelength_key(wavelength):
+    """ Hashable key of a wavelength axis, used to cache resampled spectra per laser axis"""
+    wavelength = np.ascontiguousarray(wavelength)
+    return (wavelength.size, hash(wavelength.tobytes()))
+
+
+def resample_od(comp_lambda, comp_od, wavelength):
+    """ Resamples a component OD onto the given (laser) wavelength axis.
+    Component range is padded with zeros if the laser range is bigger, same as OpticalElement.propagate used to"""
+    lambda_max = np.max(wavelength)
+    lambda_min = np.min(wavelength)
+
+    comp_lambda = np.asarray(comp_lambda)
+    comp_od = np.asarray(comp_od)
+    # flat spectra (e.g. Fiber) that cover the whole range need no interpolation
+    if lambda_min >= comp_lambda[0] and lambda_max <= comp_lambda[-1] and np.all(comp_od == comp_od[0]):
+        return np.full(np.shape(wavelength),comp_od[0],dtype=float)
+
+    # scipy is only needed when a spectrum is not in the cache yet
+    from scipy.interpolate import interp1d
+
+    in_range = (comp_lambda >= lambda_min) & (comp_lambda <= lambda_max)
+    lambda_arr = comp_lambda[in_range]
+    od_arr = comp_od[in_range]
+
+    # pad with a zeros if laser lambda range is bigger than component range
+    if lambda_max > np.max(comp_lambda):
+        lambda_arr = np.append(lambda_arr,lambda_max)
+        od_arr = np.append(od_arr,0)
+
+    if lambda_min < np.min(comp_lambda):
+        lambda_arr = np.insert(lambda_arr,0,lambda_min)
+        od_arr = np.insert(od_arr,0,0)
+
+    od = interp1d(lambda_arr,od_arr,kind='cubic',fill_value='extrapolate')
+    return od(wavelength)
+
+
+def interp_rows(xq, x, y):
+    """ np.interp of y(x) at a (n_rows x n_points) array of query points, values are held constant outside of x"""
+    xq = np.clip(xq,x[0],x[-1])
+    i = np.searchsorted(x,xq)
+    np.clip(i,1,len(x)-1,out=i)
+    i -= 1
+    # each interval as intercept + slope * x, two gathers per point instead of four
+    slope = np.diff(y) / np.diff(x)
+    intercept = y[:-1] - x[:-1] * slope
+    return np.take(intercept,i) + xq * np.take(slope,i)
+
+
+def stack_od(elements, wavelength):
+    """ (n_elements x n_wavelengths) OD array of a chain, each row already scaled (e.g. by the fiber length)"""
+    if not len(elements):
+        return np.zeros((0,len(wavelength)))
+    return np.vstack([e.od_at(wavelength) for e in elements])
+
+
+def power_from_counts(wavelength, counts):
+    """ Power of a spectrum, photon energy (1.2398/lambda) weighted sum over the last axis"""
+    energy_arr = 1.2398 / np.asarray(wavelength)
+    return np.sum(energy_arr * counts,axis=-1)
+
+
+def propagate_counts(counts, od, distance=1):
+    """ Propagates the laser counts through the whole chain in one go and applies the 1/d² distance term"""
+    total_od = np.sum(od,axis=0) if np.ndim(od) == 2 else od
+    return np.asarray(counts) * np.power(10,-total_od) / (distance**2)
+
+
+def pool_size(n_jobs, processes=None):
+    """ Number of worker processes for n_jobs, one per cpu by default"""
+    if processes is None:
+        processes = min(n_jobs,os.cpu_count() or 1)
+    return processes
+
+
+def map_jobs(func, jobs, processes=None, components=None, lasers=None, initializer=None, initargs=(), chunksize=1):
+    """ [func(job) for job in jobs] spread over a process pool, in this process when only one process is used.
+    The components and lasers (name -> path) are loaded first, so the workers only memory-map the binary cache"""
+    jobs = list(jobs)
+    if components or lasers:
+        from spectralLibrary import get_library
+        get_library().preload(components,lasers)
+    processes = pool_size(len(jobs),processes)
+    if processes > 1:
+        from concurrent.futures import ProcessPoolExecutor
+        with ProcessPoolExecutor(max_workers=processes,initializer=initializer,initargs=initargs) as executor:
+            return list(executor.map(func,jobs,chunksize=chunksize))
+    if initializer is not None:
+        initializer(*initargs)
+    return [func(j) for j in jobs]
+
+
+class OpticalChain:
+    """ Ordered chain of elements that keeps the cumulative transmission after each position.
+    Cached positions are only invalidated from the point of change onward.
+    Changes and propagation are locked, so the chain can be propagated off the bokeh thread"""
+    def __init__(self,wavelength):
+        self._lock = threading.RLock()
+        self.elements = {}
+        self.wavelength = np.asarray(wavelength)
+        self._wavelength_key = wavelength_key(self.wavelength)
+        # _prefix[i] is the transmission after the first i elements
+        self._prefix = [np.ones_like(self.wavelength,dtype=float)]
+
+    def __len__(self):
+        return len(self.elements)
+
+    def set_wavelength(self,wavelength):
+        """ Changes the wavelength axis (e.g. new laser), cache is kept if the axis is the same"""
+        key = wavelength_key(wavelength)
+        with self._lock:
+            if key != self._wavelength_key:
+                self.wavelength = np.asarray(wavelength)
+                self._wavelength_key = key
+                self._prefix = [np.ones_like(self.wavelength,dtype=float)]
+
+    def invalidate(self,index=0):
+        """ Drops the cached transmissions after position index"""
+        with self._lock:
+            del self._prefix[index+1:]
+
+    def append(self,key,element):
+        with self._lock:
+            self.elements[key] = element
+
+    def invalidate_element(self,key):
+        """ Drops the cached transmissions from the element onward, e.g. after it was tilted"""
+        with self._lock:
+            self.invalidate(list(self.elements.keys()).index(key))
+
+    def set_angle(self,key,angle):
+        """ Tilts an element (degrees), its angle and the cached transmissions change under one lock"""
+        with self._lock:
+            self.elements[key].angle = angle
+            self.invalidate_element(key)
+
+    def remove(self,key):
+        with self._lock:
+            self.invalidate_element(key)
+            return self.elements.pop(key)
+
+    def transmission(self):
+        """ Transmission after the whole chain, only the uncached tail is computed"""
+        with self._lock:
+            start = len(self._prefix) - 1
+            elements = list(self.elements.values())
+            if start < len(elements):
+                with stage('propagate'):
+                    if start == len(elements) - 1:
+                        # appended one element, one multiply
+                        self._prefix.append(self._prefix[-1] * np.power(10,-elements[-1].od_at(self.wavelength)))
+                    else:
+                        od = np.cumsum(stack_od(elements[start:],self.wavelength),axis=0)
+                        self._prefix.extend(self._prefix[-1] * np.power(10,-od))
+            return self._prefix[len(elements)]
+
+    def propagate(self,counts,distance=1):
+        """ Propagates the counts through the chain and the distance"""
+        transmission = self.transmission()
+        with stage('distance'):
+            return np.asarray(counts) * transmission / (distance**2)
+
+    def configuration(self):
+        """ What the transmission depends on: component paths in chain order ((path, angle, n_eff) for tilted
+        elements), the total fiber length (its OD scales with the length) and the wavelength axis key"""
+        with self._lock:
+            elements = list(self.elements.values())
+            components = [(e.path,e.angle,e.n_eff) if e.angle else e.path for e in elements]
+            fiber_length = sum(e.length for e in elements if e.name == 'Fiber')
+            return components,fiber_length,self._wavelength_key
+
+    def propagate_with_configuration(self,counts,distance=1):
+        """ propagate and the configuration it was computed for, read under one lock so a concurrent
+        change of the chain cannot end up in between"""
+        with self._lock:
+            return self.propagate(counts,distance),self.configuration()
@@ -0,0 +1,158 @@
+import numpy as np
+from bokeh.models import ColumnDataSource
+
+from instrumentation import stage, timed
+
+
+SPEC_COLUMNS = ['Wavelength','Transmission','od','color','name','key']
+
+# points outside of the visible x range get this fraction of the plot width as bins
+OUTSIDE_DETAIL = 0.25
+
+
+def empty_spec_data():
+    return {k:[] for k in SPEC_COLUMNS}
+
+
+def minmax_decimate(x,y,n_bins):
+    """ Decimates a curve to n_bins by keeping the min and max point of each bin (in original order),
+    so peaks and edges survive. First and last points are always kept"""
+    x = np.asarray(x)
+    y = np.asarray(y)
+    n = len(x)
+    if n <= 2*n_bins + 2:
+        return x,y
+    bin_size = int(np.ceil(n / n_bins))
+    n_rows = int(np.ceil(n / bin_size))
+    # pad with the last value, it does not change the min/max of the last bin
+    padded = np.pad(y,(0,n_rows*bin_size - n),mode='edge').reshape(n_rows,bin_size)
+    offset = np.arange(n_rows) * bin_size
+    idx = np.concatenate(([0,n-1],offset + np.argmin(padded,axis=1),offset + np.argmax(padded,axis=1)))
+    idx = np.unique(np.minimum(idx,n-1))
+    return x[idx],y[idx]
+
+
+def decimate_view(x,y,n_pixels,view=None):
+    """ Min/max decimation at pixel resolution inside the visible view=(start,end),
+    the parts outside are kept coarse so the data bounds (and auto ranges) stay the same"""
+    if view is None or view[0] is None or view[1] is None:
+        x_out,y_out = minmax_decimate(x,y,n_pixels)
+    else:
+        i0,i1 = np.searchsorted(x,view)
+        # keep one point on each side of the view so the line reaches the edges
+        i0 = max(i0-1,0)
+        i1 = min(i1+1,len(x))
+        coarse = max(int(n_pixels*OUTSIDE_DETAIL),1)
+        parts = [minmax_decimate(x[:i0],y[:i0],coarse),
+                 minmax_decimate(x[i0:i1],y[i0:i1],n_pixels),
+                 minmax_decimate(x[i1:],y[i1:],coarse)]
+        x_out = np.concatenate([p[0] for p in parts])
+        y_out = np.concatenate([p[1] for p in parts])
+    # typed arrays go through the binary buffer protocol
+    return x_out.astype(np.float32),y_out.astype(np.float32)
+
+
+def plot_view(plot):
+    return (plot.x_range.start,plot.x_range.end)
+
+
+class DecimatedLine:
+    """ Single line source that only ever sends a decimated, typed copy of the full resolution data"""
+    def __init__(self,plot,x_name,y_name):
+        self.plot = plot
+        self.x_name = x_name
+        self.y_name = y_name
+        self.x = np.array([])
+        self.y = np.array([])
+        self.source = ColumnDataSource(data={x_name:self.x,y_name:self.y})
+
+    def set_data(self,x,y):
+        self.x = np.asarray(x)
+        self.y = np.asarray(y)
+        self.refine()
+
+    def refine(self):
+        with stage('serialize'):
+            x,y = decimate_view(self.x,self.y,self.plot.plot_width,plot_view(self.plot))
+        with stage('patch'):
+            self.source.data = {self.x_name:x,self.y_name:y}
+
+
+class ChainRenderer:
+    """ Render layer of the optical chain. Every plot role gets one renderer which is created once,
+    each component's glyphs are added once and later changes only stream/patch/replace source data,
+    so the document does not grow with every edit"""
+    def __init__(self,path_plot,transmission_plot,od_plot,optical_path_src):
+        self.path_plot = path_plot
+        self.transmission_plot = transmission_plot
+        self.od_plot = od_plot
+        self.transmission_src = ColumnDataSource(data=empty_spec_data())
+        self.od_src = ColumnDataSource(data=empty_spec_data())
+        self.optical_path_src = optical_path_src
+        # key -> full resolution component, decimated copies are what gets sent
+        self.components = {}
+        # key -> glyph renderers of the component in the path plot
+        self.component_renderers = {}
+
+        self.transmission_renderer = transmission_plot.multi_line(xs='Wavelength',ys='Transmission',line_color='color',line_dash='dashed',source=self.transmission_src)
+        self.od_renderer = od_plot.multi_line(xs='Wavelength',ys='od',line_color='color',source=self.od_src)
+
+    def _row(self,key,plot,column):
+        comp = self.components[key]
+        y = comp.transmission if column == 'Transmission' else comp.od
+        x,y = decimate_view(comp.wavelength,y,plot.plot_width,plot_view(plot))
+        return {'Wavelength':x,
+                column:y,
+                'color':comp.color,
+                'name':comp.name,
+                'key':key}
+
+    def _spec_data(self,plot,column):
+        rows = [self._row(k,plot,column) for k in self.components]
+        return {c:[r.get(c,[]) for r in rows] for c in SPEC_COLUMNS}
+
+    def add_component(self,key,comp):
+        """ Streams the decimated spectrum of the component and adds its glyphs to the path plot"""
+        self.components[key] = comp
+        for src,plot,column in [(self.transmission_src,self.transmission_plot,'Transmission'),
+                                (self.od_src,self.od_plot,'od')]:
+            with stage('serialize'):
+                row = self._row(key,plot,column)
+            with stage('patch'):
+                src.stream({c:[row.get(c,[])] for c in SPEC_COLUMNS})
+
+        with stage('patch'):
+            self.component_renderers[key] = [self.path_plot.add_glyph(comp.shape_source,g) for g in comp.shape_glyph]
+
+    def remove_component(self,key):
+        """ Drops the spectrum row of the component and detaches its glyph renderers"""
+        self.components.pop(key,None)
+        self.refine_transmission()
+        self.refine_od()
+
+        renderers = self.component_renderers.pop(key,[])
+        with stage('patch'):
+            self.path_plot.renderers = [r for r in self.path_plot.renderers if r not in renderers]
+
+    def refine_transmission(self):
+        """ Re-decimates the transmission curves for the current view"""
+        with stage('serialize'):
+            data = self._spec_data(self.transmission_plot,'Transmission')
+        with stage('patch'):
+            self.transmission_src.data = data
+
+    def refine_od(self):
+        """ Re-decimates the OD curves for the current view"""
+        with stage('serialize'):
+            data = self._spec_data(self.od_plot,'od')
+        with stage('patch'):
+            self.od_src.data = data
+
+    @timed('patch')
+    def update_sample(self,x,beam_w):
+        """ Moves the sample marker and sets the beam width in place"""
+        self.optical_path_src.patch({'x':[(0,x)],
+                                     'y':[(0,-1)],
+                                     'x1':[(0,x)],
+                                     'y1':[(0,1)],
+                                     'beam_w':[(0,beam_w)]})
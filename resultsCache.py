@@ -0,0 +1,164 @@
+import os
+import json
+import atexit
+import hashlib
+import tempfile
+import threading
+from collections import OrderedDict
+
+import numpy as np
+
+from spectralLibrary import DATA_ROOT, CACHE_VERSION
+
+
+def config_key(laser_path,components,fiber_length,distance,knob):
+    """ Canonical hash of a chain configuration. components is the ordered list of component csv paths,
+    or (path, angle, n_eff) for tilted ones. csv modification times are part of the key so edited spectra
+    are never served from the cache"""
+    def version(path):
+        full_path = os.path.join(DATA_ROOT,path)
+        return os.stat(full_path).st_mtime_ns if os.path.isfile(full_path) else 0
+    config = [CACHE_VERSION,
+              [laser_path,version(laser_path)],
+              [[p,version(p)] if isinstance(p,str) else [list(p),version(p[0])] for p in components],
+              float(fiber_length),
+              float(distance),
+              float(knob)]
+    return hashlib.sha1(json.dumps(config).encode()).hexdigest()
+
+
+class ResultsCache:
+    """ LRU cache of propagated spectra and integrated power keyed by config_key.
+    Evicts the least recently used entries above max_entries or max_bytes, optionally persisted to
+    a directory (one .npy per entry plus the LRU order) so results survive server restarts.
+    The index is only rewritten every index_interval puts and by flush, entries missing from it are dropped on load"""
+    def __init__(self,max_entries=512,max_bytes=64*2**20,path=None,index_interval=16):
+        self.max_entries = max_entries
+        self.max_bytes = max_bytes
+        self.path = path
+        self.index_interval = index_interval
+        self.hits = 0
+        self.misses = 0
+        self._entries = OrderedDict()
+        self._nbytes = 0
+        self._unsaved = 0
+        self._lock = threading.Lock()
+        if path is not None:
+            self._load_index()
+
+    def __len__(self):
+        return len(self._entries)
+
+    def _entry_file(self,key):
+        return os.path.join(self.path,key + '.npy')
+
+    def _index_file(self):
+        return os.path.join(self.path,'index.json')
+
+    def _load_index(self):
+        os.makedirs(self.path,exist_ok=True)
+        try:
+            with open(self._index_file()) as f:
+                index = json.load(f)
+        except (OSError,ValueError):
+            return
+        for key,power in index:
+            entry_file = self._entry_file(key)
+            if not os.path.isfile(entry_file):
+                continue
+            try:
+                counts = np.load(entry_file,mmap_mode='r')
+            except (OSError,ValueError) as e:
+                # e.g. truncated by a crash, it is only a cache
+                print('Dropping results cache entry {0}: {1}'.format(key,e))
+                os.remove(entry_file)
+                continue
+            self._entries[key] = (counts,power)
+            self._nbytes += counts.nbytes
+        # results written after the last index save have no power, they can not be used
+        for filename in os.listdir(self.path):
+            key,ext = os.path.splitext(filename)
+            if (ext == '.npy' and key not in self._entries) or ext == '.tmp':
+                os.remove(os.path.join(self.path,filename))
+        self._evict()
+
+    def _write_file(self,target,write):
+        """ Writes through a unique temp file, readers never see a partial file"""
+        fd,tmp_file = tempfile.mkstemp(dir=self.path,suffix='.tmp')
+        try:
+            with os.fdopen(fd,'wb') as f:
+                write(f)
+            os.replace(tmp_file,target)
+        except BaseException:
+            os.remove(tmp_file)
+            raise
+
+    def _save_index(self):
+        index = [[k,p] for k,(_,p) in self._entries.items()]
+        self._unsaved = 0
+        self._write_file(self._index_file(),lambda f: f.write(json.dumps(index).encode()))
+
+    def flush(self):
+        """ Saves the index if entries were added since the last save"""
+        if self.path is None:
+            return
+        with self._lock:
+            if self._unsaved:
+                self._save_index()
+
+    def _evict(self):
+        while len(self._entries) > self.max_entries or (self._nbytes > self.max_bytes and len(self._entries) > 1):
+            key,(counts,_) = self._entries.popitem(last=False)
+            self._nbytes -= counts.nbytes
+            if self.path is not None and os.path.isfile(self._entry_file(key)):
+                os.remove(self._entry_file(key))
+
+    def get(self,key):
+        """ (counts, power) of a configuration, None if it was not computed yet"""
+        with self._lock:
+            entry = self._entries.get(key)
+            if entry is None:
+                self.misses += 1
+                return None
+            self._entries.move_to_end(key)
+            self.hits += 1
+            return entry
+
+    def put(self,key,counts,power):
+        counts = np.array(counts,dtype=np.float64)
+        counts.setflags(write=False)
+        with self._lock:
+            if key in self._entries:
+                self._nbytes -= self._entries[key][0].nbytes
+            if self.path is not None:
+                self._write_file(self._entry_file(key),lambda f: np.save(f,counts))
+            self._entries[key] = (counts,float(power))
+            self._entries.move_to_end(key)
+            self._nbytes += counts.nbytes
+            self._evict()
+            if self.path is not None:
+                self._unsaved += 1
+                if self._unsaved >= self.index_interval:
+                    self._save_index()
+
+    def clear(self):
+        with self._lock:
+            keys = list(self._entries.keys())
+            self._entries.clear()
+            self._nbytes = 0
+            if self.path is not None:
+                for key in keys:
+                    if os.path.isfile(self._entry_file(key)):
+                        os.remove(self._entry_file(key))
+                self._save_index()
+
+
+_results_cache = None
+
+def get_results_cache():
+    """ Process wide results cache, persisted to OPTOPATH_RESULTS_CACHE (a directory) when it is set"""
+    global _results_cache
+    if _results_cache is None:
+        _results_cache = ResultsCache(path=os.environ.get('OPTOPATH_RESULTS_CACHE') or None)
+        atexit.register(_results_cache.flush)
+    return _results_cache
@@ -0,0 +1,60 @@
+""" One-off power at sample queries from the command line, only needs numpy once the spectra are cached.
+
+    python sample_power.py --laser "445nm Blue" -c "Semrock 468 SP" -c Fiber --distance 3
+    python sample_power.py --laser "445nm Blue" -c Fiber --splitter "Semrock 480 Di" -r "Semrock 468 SP"
+"""
+import argparse
+
+from spectralLibrary import laser_path_lookup
+from catalog import component_path
+from sweep import chain_power, split_power
+
+
+def main(argv=None):
+    parser = argparse.ArgumentParser(description='Power on sample for a laser through a chain of components')
+    parser.add_argument('--laser',default='445nm Blue',choices=list(laser_path_lookup.keys()))
+    parser.add_argument('-c','--component',action='append',default=[],
+                        help='component to add to the chain, in order (repeat for more)')
+    parser.add_argument('-d','--distance',type=float,nargs='+',default=[1],help='distance(s) to the sample in mm')
+    parser.add_argument('-k','--knob',type=float,default=0,help='knob value')
+    parser.add_argument('--fiber-length',type=float,default=1)
+    parser.add_argument('--splitter',default=None,
+                        help='beam splitter after the chain, reports the power on its transmitted and reflected arms')
+    parser.add_argument('-t','--transmitted',action='append',default=[],help='component on the transmitted arm')
+    parser.add_argument('-r','--reflected',action='append',default=[],help='component on the reflected arm')
+    parser.add_argument('--tolerance',type=int,default=0,metavar='N',
+                        help='Monte Carlo tolerance analysis with N perturbed realizations')
+    parser.add_argument('--seed',type=int,default=None)
+    args = parser.parse_args(argv)
+    # hand picked names resolve without scanning the catalog, which only happens for the others
+    names = args.component + args.transmitted + args.reflected + ([args.splitter] if args.splitter else [])
+    for name in names:
+        try:
+            component_path(name)
+        except KeyError:
+            parser.error('unknown component: {0!r}'.format(name))
+
+    if args.splitter is not None:
+        power = split_power(args.component,args.splitter,args.transmitted,args.reflected,
+                            [args.laser],args.distance,[args.knob],args.fiber_length)[0,:,:,0]
+        for arm,arm_power in zip(['transmitted','reflected'],power):
+            for d,p in zip(args.distance,arm_power):
+                print('Power on sample ({0}) at {1} mm: {2} mW/mm²'.format(arm,d,p))
+        return power
+
+    power = chain_power(args.component,[args.laser],args.distance,[args.knob],args.fiber_length)[0,:,0]
+    for d,p in zip(args.distance,power):
+        print('Power on sample at {0} mm: {1} mW/mm²'.format(d,p))
+    if args.tolerance:
+        from tolerance import tolerance_analysis
+        for d in args.distance:
+            summary,_ = tolerance_analysis(args.laser,args.component,d,args.fiber_length,
+                                           n_samples=args.tolerance,seed=args.seed)
+            print('Tolerance analysis at {0} mm ({1} samples):'.format(d,args.tolerance))
+            for k,v in summary.items():
+                print('    {0:<8}{1}'.format(k,v))
+    return power
+
+
+if __name__ == '__main__':
+    main()
@@ -0,0 +1,266 @@
+import os
+import hashlib
+import tempfile
+import threading
+
+import numpy as np
+
+from propagation import wavelength_key, resample_od
+from instrumentation import stage
+
+# pandas and scipy are only imported when a csv has to be parsed, cache hits only need numpy
+
+# canonical wavelength grid every component spectrum is resampled to
+WAVELENGTH_GRID = np.arange(300,1200,0.2)
+
+# relative csv paths are resolved against the repository
+DATA_ROOT = os.path.dirname(os.path.abspath(__file__))
+
+# bump this when the on-disk layout or the resampling changes
+CACHE_VERSION = 1
+CACHE_DIR = os.path.join(DATA_ROOT,'.spectral_cache')
+
+# Measured knob powers to be used in 
+knob_power_lookup = {}
+
+# csv data paths for components
+component_path_lookup = {'Thorlabs 450/10' : 'csv_data/thorlabs/FB450-10_Spectrum.csv',
+                         'Thorlabs 450 LP' : 'csv_data/thorlabs/FEL0450_Spectrum.csv',
+                         'Semrock 468 SP'  : 'csv_data/semrock/FF01-468_SP_Spectrum.csv',
+                         'Semrock 460/14'  : 'csv_data/semrock/FF01-460-14_Spectrum.csv',
+                         'Semrock 442 LP'  : 'csv_data/semrock/BLP01-442R_Spectrum.csv',
+                         'Semrock 430 LP'  : 'csv_data/semrock/FF01-430_LP_Spectrum.csv',
+                         'Semrock 562 Di'  : 'csv_data/semrock/FF562-Di03_Spectrum.csv',
+                         'Semrock 480 Di'  : 'csv_data/semrock/LM01-480_Spectrum.csv',
+                         'Fiber'           : 'Fiber'} 
+
+laser_path_lookup = {'445nm Blue'  : 'csv_data/laser/no_filter_laser.csv',
+                     '540nm Green' : 'csv_data/laser/single_filter_laser.csv'}
+
+COMPONENT_COLUMNS = ['Wavelength','Transmission','od']
+LASER_COLUMNS = ['Wavelength','Counts','max_norm_counts','sum_norm_counts']
+
+
+def detect_format(path):
+    """ Vendor format of a spectrum file from its first line, None if it is not a known one.
+    Semrock files start with a text header, Thorlabs files with the tab separated column names"""
+    with open(path,errors='replace') as f:
+        first = f.readline().strip()
+    if first.startswith('Theoretical Spectrum') or 'Semrock' in first:
+        return 'semrock'
+    columns = first.split('\t')
+    if columns[0] == 'Wavelength' and 'od' in columns and 'Transmission' in columns:
+        return 'thorlabs'
+    return None
+
+
+def read_thorlabs(path):
+    """ Reads a Thorlabs tab separated spectrum and resamples it onto the canonical grid.
+    Rows with missing or non-numeric values (e.g. #NUM! cells) are dropped"""
+    import pandas as pd
+    from scipy.interpolate import interp1d
+
+    temp = pd.read_csv(path,sep='\t',usecols=['Wavelength','od','Transmission'])
+    temp = temp.apply(pd.to_numeric,errors='coerce').dropna()
+    wavelength = temp['Wavelength'].to_numpy()
+    transmission = temp['Transmission'].to_numpy() / 100
+    trans = interp1d(wavelength,transmission,kind='cubic')
+    od = interp1d(wavelength,temp['od'],kind='cubic')
+    spectra = WAVELENGTH_GRID[(WAVELENGTH_GRID >= wavelength.min()) & (WAVELENGTH_GRID <= wavelength.max())]
+    return np.column_stack((spectra,trans(spectra),od(spectra)))
+
+
+def _header_line(path):
+    """ Line number of the column names, the text header is not always the same length"""
+    with open(path,errors='replace') as f:
+        for i,line in enumerate(f):
+            if line.strip().startswith('Wavelength'):
+                return i
+    raise ValueError('No Wavelength column in {0}'.format(path))
+
+
+def read_semrock(path):
+    """ Reads a Semrock spectrum (text header) and resamples it onto the canonical grid.
+    Grid points outside of the measured range are dropped so propagation can pad them"""
+    import pandas as pd
+
+    temp = pd.read_csv(path,sep=r'\s+',skiprows=_header_line(path)+1,names=['Wavelength','Transmission'],usecols=[0,1])
+    temp = temp.apply(pd.to_numeric,errors='coerce').dropna()
+    wavelength = temp['Wavelength'].to_numpy()
+    transmission = temp['Transmission'].to_numpy()
+    # semrock spectra are already sampled at 0.2nm, so this is a (near) exact pick
+    spectra = WAVELENGTH_GRID[(WAVELENGTH_GRID >= wavelength.min() - 1e-6) & (WAVELENGTH_GRID <= wavelength.max() + 1e-6)]
+    transmission = np.interp(spectra,wavelength,transmission)
+    return np.column_stack((spectra,transmission,np.log10(1/transmission)))
+
+
+def make_fiber():
+    """ Fiber spectrum, assume no loss for now"""
+    spectra = WAVELENGTH_GRID
+    transmission = np.ones_like(spectra) * 0.98
+    return np.column_stack((spectra,transmission,np.log10(1/transmission)))
+
+
+def read_laser(path):
+    """ Reads a laser spectrum, clips negative counts and adds the normalized columns"""
+    import pandas as pd
+
+    temp = pd.read_csv(path,sep='\t')
+    counts = np.clip(temp['Counts'].to_numpy(),0,None)
+    return np.column_stack((temp['Wavelength'].to_numpy(),
+                            counts,
+                            counts / np.max(counts),
+                            counts / np.sum(counts)))
+
+
+def read_component(path):
+    """ Dispatches to the vendor reader depending on the file format"""
+    if path == 'Fiber':
+        return make_fiber()
+    file_format = detect_format(path)
+    if file_format == 'thorlabs':
+        return read_thorlabs(path)
+    elif file_format == 'semrock':
+        return read_semrock(path)
+    raise ValueError('Unknown component format: {0}'.format(path))
+
+
+class SpectralLibrary:
+    """ Loads every spectrum once, keeps it as a memory-mapped binary cache on disk
+    (keyed by file path and mtime) and hands out zero-copy, read-only views of it.
+    One library is shared by every bokeh session of the server process (see get_library)"""
+    def __init__(self,cache_dir=CACHE_DIR):
+        self.cache_dir = cache_dir
+        self._arrays = {}
+        # (path, wavelength key) -> component OD resampled on that axis
+        self._resampled = {}
+        # misses are computed once, sessions and worker threads may ask for the same spectrum at the same time
+        self._lock = threading.RLock()
+
+    def cache_path(self,path,kind):
+        """ Path of the binary cache file for a csv, changes whenever the csv is modified"""
+        mtime = os.stat(path).st_mtime_ns
+        key = '{0}|{1}|{2}|{3}'.format(os.path.abspath(path),mtime,kind,CACHE_VERSION)
+        return os.path.join(self.cache_dir,hashlib.sha1(key.encode()).hexdigest() + '.npy')
+
+    def _cached_array(self,full_path,kind,compute):
+        """ Memory-maps the binary cache of an array derived from a csv, computes and saves it first if needed"""
+        cache_file = self.cache_path(full_path,kind)
+        if not os.path.isfile(cache_file):
+            os.makedirs(self.cache_dir,exist_ok=True)
+            # unique name, other processes may be writing the same cache file
+            fd,tmp_file = tempfile.mkstemp(dir=self.cache_dir,suffix='.tmp')
+            try:
+                with os.fdopen(fd,'wb') as f:
+                    np.save(f,np.ascontiguousarray(compute(),dtype=np.float64))
+                os.replace(tmp_file,cache_file)
+            except BaseException:
+                os.remove(tmp_file)
+                raise
+        return np.load(cache_file,mmap_mode='r')
+
+    def _load(self,path,kind,reader,keep=True):
+        arr = self._arrays.get(path)
+        if arr is not None:
+            return arr
+        with self._lock:
+            if path in self._arrays:
+                return self._arrays[path]
+            full_path = os.path.join(DATA_ROOT,path)
+            with stage('load'):
+                if not os.path.isfile(full_path):
+                    # no file to key on (e.g. Fiber), just keep it in memory
+                    arr = reader(path)
+                    arr.setflags(write=False)
+                else:
+                    arr = self._cached_array(full_path,kind,lambda: reader(full_path))
+            if keep:
+                self._arrays[path] = arr
+            return arr
+
+    def component_array(self,path,keep=True):
+        """ (n x 3) array of Wavelength, Transmission, od on the canonical grid.
+        keep=False fills the binary cache without holding on to the array (e.g. when indexing every part)"""
+        return self._load(path,'component',read_component,keep)
+
+    def laser_array(self,path):
+        """ (n x 4) array of Wavelength, Counts, max_norm_counts, sum_norm_counts"""
+        return self._load(path,'laser',read_laser)
+
+    def component(self,path):
+        """ DataFrame view of a component spectrum, no data is copied"""
+        import pandas as pd
+        return pd.DataFrame(data=self.component_array(path),columns=COMPONENT_COLUMNS,copy=False)
+
+    def laser(self,path):
+        """ DataFrame view of a laser spectrum, no data is copied"""
+        import pandas as pd
+        return pd.DataFrame(data=self.laser_array(path),columns=LASER_COLUMNS,copy=False)
+
+    def component_od32(self,path):
+        """ float32 OD of a component on its grid, shared read-only copy for display and small elements"""
+        key = (path,'od32')
+        od = self._resampled.get(key)
+        if od is None:
+            with self._lock:
+                od = self._resampled.get(key)
+                if od is None:
+                    od = self.component_array(path)[:,2].astype(np.float32)
+                    od.setflags(write=False)
+                    self._resampled[key] = od
+        return od
+
+    def resampled_od(self,path,wavelength):
+        """ Component OD resampled onto a (laser) wavelength axis, computed once per process and shared read-only"""
+        key = (path,wavelength_key(wavelength))
+        od = self._resampled.get(key)
+        if od is not None:
+            return od
+        with self._lock:
+            od = self._resampled.get(key)
+            if od is None:
+                comp = self.component_array(path)
+                compute = lambda: resample_od(comp[:,0],comp[:,2],wavelength)
+                full_path = os.path.join(DATA_ROOT,path)
+                with stage('resample'):
+                    if os.path.isfile(full_path):
+                        # resampled spectra are cached on disk too, so cold starts skip scipy
+                        digest = hashlib.sha1(np.ascontiguousarray(wavelength,dtype=np.float64).tobytes()).hexdigest()
+                        od = self._cached_array(full_path,'resampled|' + digest,compute)
+                    else:
+                        od = compute()
+                        od.setflags(write=False)
+                self._resampled[key] = od
+            return od
+
+    def preload(self,component_lookup=None,laser_lookup=None):
+        """ Loads (and caches) every spectrum in the given name->path lookups"""
+        for path in (component_lookup or {}).values():
+            self.component_array(path)
+        for path in (laser_lookup or {}).values():
+            self.laser_array(path)
+
+
+_library = None
+
+def get_library():
+    """ Returns the process wide spectral library. Modules are only imported once per server process,
+    so every session re-executing the app gets this same instance"""
+    global _library
+    if _library is None:
+        _library = SpectralLibrary()
+    return _library
+
+
+def load_shared_store(component_lookup=None,laser_lookup=None):
+    """ Loads every spectrum and resamples every component onto every laser axis,
+    so sessions only reference the shared arrays"""
+    component_lookup = component_path_lookup if component_lookup is None else component_lookup
+    laser_lookup = laser_path_lookup if laser_lookup is None else laser_lookup
+    library = get_library()
+    library.preload(component_lookup,laser_lookup)
+    for laser_path in laser_lookup.values():
+        wavelength = library.laser_array(laser_path)[:,0]
+        for path in component_lookup.values():
+            library.resampled_od(path,wavelength)
+    return library
@@ -0,0 +1,180 @@
+""" Live spectrometer input. Frames are read from a local source on a background thread into a fixed size
+ring buffer, so memory stays bounded however long the stream runs. Does not need bokeh.
+
+Sources (see open_source):
+    file:/path/to/frames.txt   tailed text file, one frame (whitespace/comma separated counts) per line
+    pipe:/path/to/fifo         named pipe, same text format
+    udp:127.0.0.1:5005         local socket, one frame of float32 counts per datagram
+
+A stand-in spectrometer that replays a laser csv with some drift:
+
+    python streaming.py udp:127.0.0.1:5005 --laser "445nm Blue" --rate 30
+"""
+import os
+import time
+import socket
+import threading
+
+import numpy as np
+
+
+class RingBuffer:
+    """ Fixed size buffer of the last capacity frames (and their timestamps)"""
+    def __init__(self,capacity,n_pixels,dtype=np.float32):
+        self.frames = np.zeros((capacity,n_pixels),dtype=dtype)
+        self.times = np.zeros(capacity)
+        self.capacity = capacity
+        self.count = 0
+        self._lock = threading.Lock()
+
+    def push(self,frame,timestamp=None):
+        with self._lock:
+            i = self.count % self.capacity
+            self.frames[i] = frame
+            self.times[i] = time.time() if timestamp is None else timestamp
+            self.count += 1
+
+    def latest(self):
+        """ (timestamp, frame copy, frame number) of the newest frame, None if empty"""
+        with self._lock:
+            if not self.count:
+                return None
+            i = (self.count - 1) % self.capacity
+            return self.times[i],self.frames[i].copy(),self.count
+
+    def __len__(self):
+        return min(self.count,self.capacity)
+
+
+def parse_text_frame(line):
+    return np.array(line.replace(',',' ').split(),dtype=np.float32)
+
+
+class TextSource:
+    """ Tails a text file or reads a named pipe, one frame per line"""
+    def __init__(self,path,from_start=False):
+        self.path = path
+        flags = os.O_RDONLY | (os.O_NONBLOCK if hasattr(os,'O_NONBLOCK') else 0)
+        self._file = os.fdopen(os.open(path,flags),'r')
+        if not from_start and os.path.isfile(path):
+            self._file.seek(0,os.SEEK_END)
+        self._partial = ''
+
+    def read(self):
+        """ Returns the complete frames that arrived since the last read"""
+        try:
+            chunk = self._file.read()
+        except (BlockingIOError,TypeError):
+            chunk = None
+        if not chunk:
+            return []
+        lines = (self._partial + chunk).split('\n')
+        self._partial = lines.pop()
+        return [parse_text_frame(l) for l in lines if l.strip()]
+
+    def close(self):
+        self._file.close()
+
+
+class UDPSource:
+    """ Local socket stand-in for a spectrometer, one float32 frame per datagram"""
+    def __init__(self,host,port):
+        self._sock = socket.socket(socket.AF_INET,socket.SOCK_DGRAM)
+        self._sock.setsockopt(socket.SOL_SOCKET,socket.SO_RCVBUF,1 << 22)
+        self._sock.bind((host,port))
+        self._sock.setblocking(False)
+
+    def read(self):
+        frames = []
+        while True:
+            try:
+                data = self._sock.recv(1 << 16)
+            except (BlockingIOError,InterruptedError):
+                return frames
+            frames.append(np.frombuffer(data,dtype=np.float32))
+
+    def close(self):
+        self._sock.close()
+
+
+def open_source(spec):
+    """ Opens a source from its 'kind:address' description"""
+    kind,_,address = spec.partition(':')
+    if kind in ('file','pipe'):
+        return TextSource(address)
+    if kind == 'udp':
+        host,_,port = address.rpartition(':')
+        return UDPSource(host or '127.0.0.1',int(port))
+    raise ValueError('Unknown stream source: {0}'.format(spec))
+
+
+class SpectrometerStream:
+    """ Reads frames from a source on a daemon thread into a RingBuffer.
+    Frames that do not match the spectrometer pixel count are dropped"""
+    def __init__(self,source,n_pixels,capacity=256,poll_interval=0.002):
+        self.source = source
+        self.buffer = RingBuffer(capacity,n_pixels)
+        self.n_pixels = n_pixels
+        self.poll_interval = poll_interval
+        self.dropped = 0
+        self._stop = threading.Event()
+        self._thread = threading.Thread(target=self._run,name='spectrometer-stream',daemon=True)
+
+    def start(self):
+        self._thread.start()
+        return self
+
+    def stop(self):
+        self._stop.set()
+        self._thread.join(timeout=1)
+        self.source.close()
+
+    def _run(self):
+        while not self._stop.is_set():
+            frames = self.source.read()
+            for frame in frames:
+                if len(frame) == self.n_pixels:
+                    self.buffer.push(frame)
+                else:
+                    self.dropped += 1
+            if not frames:
+                self._stop.wait(self.poll_interval)
+
+
+def frame_counts(frame,reference_total):
+    """ Cleans a raw frame like the laser csv (negative counts clipped) and normalizes it by the reference
+    laser's total counts, so drift in laser power shows up as drift in power at the sample"""
+    return np.clip(frame,0,None) / reference_total
+
+
+def _simulate(target,laser_name,rate,drift):
+    """ Replays a laser csv as frames with a slow power drift and a small wavelength jitter"""
+    from spectralLibrary import get_library, laser_path_lookup
+    counts = get_library().laser_array(laser_path_lookup[laser_name])[:,1].astype(np.float32)
+    kind,_,address = target.partition(':')
+    if kind == 'udp':
+        host,_,port = address.rpartition(':')
+        sock = socket.socket(socket.AF_INET,socket.SOCK_DGRAM)
+        send = lambda frame: sock.sendto(frame.tobytes(),(host or '127.0.0.1',int(port)))
+    else:
+        out = open(address,'a',buffering=1)
+        send = lambda frame: out.write(' '.join('{0:.3f}'.format(v) for v in frame) + '\n')
+    rng = np.random.default_rng()
+    t0 = time.time()
+    while True:
+        t = time.time() - t0
+        scale = 1 + drift * np.sin(2 * np.pi * t / 60)
+        frame = np.roll(counts,int(rng.integers(-1,2))) * scale + rng.normal(0,5,len(counts)).astype(np.float32)
+        send(frame.astype(np.float32))
+        time.sleep(1 / rate)
+
+
+if __name__ == '__main__':
+    import argparse
+    parser = argparse.ArgumentParser(description='Stand-in spectrometer that streams a laser csv')
+    parser.add_argument('target',help='udp:host:port or file:/path (pipes use file: too)')
+    parser.add_argument('--laser',default='445nm Blue')
+    parser.add_argument('--rate',type=float,default=30,help='frames per second')
+    parser.add_argument('--drift',type=float,default=0.1,help='relative power drift amplitude')
+    args = parser.parse_args()
+    _simulate(args.target,args.laser,args.rate,args.drift)
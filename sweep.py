@@ -0,0 +1,110 @@
+""" Headless power at sample calculations, does not need bokeh.
+
+    >>> from sweep import power_sweep
+    >>> power_sweep(chains=[['Semrock 468 SP'],['Thorlabs 450/10','Fiber']],distances=range(1,21),knobs=[0,5,10])
+"""
+from itertools import product
+
+import numpy as np
+
+from spectralLibrary import get_library, laser_path_lookup, knob_power_lookup
+from catalog import component_path
+from propagation import power_from_counts, pool_size, map_jobs
+
+
+def knob_scale(knobs,lookup=None):
+    """ Laser power scale for each knob value, interpolated from the measured knob powers.
+    Without measurements the power is left unscaled"""
+    lookup = knob_power_lookup if lookup is None else lookup
+    knobs = np.asarray(knobs,dtype=float)
+    if not len(lookup):
+        return np.ones_like(knobs)
+    knob_values = np.array(sorted(lookup.keys()),dtype=float)
+    powers = np.array([lookup[k] for k in sorted(lookup.keys())],dtype=float)
+    return np.interp(knobs,knob_values,powers)
+
+
+def component_od(name,wavelength):
+    """ OD of a component on the given wavelength axis, resampled once per process"""
+    return get_library().resampled_od(component_path(name),wavelength)
+
+
+def chain_od(chain,wavelength,fiber_length=1):
+    """ Total OD of a chain of component names on the given wavelength axis"""
+    od = np.zeros_like(wavelength,dtype=float)
+    for name in chain:
+        comp_od = component_od(name,wavelength)
+        if name == 'Fiber':
+            comp_od = fiber_length * comp_od
+        od += comp_od
+    return od
+
+
+def chain_power(chain,lasers,distances,knobs,fiber_length=1):
+    """ (n_lasers x n_distances x n_knobs) power at the sample for one chain"""
+    library = get_library()
+    distances = np.asarray(distances,dtype=float)
+    scale = knob_scale(knobs)
+    power = np.empty((len(lasers),len(distances),len(scale)))
+    for i,laser_name in enumerate(lasers):
+        laser = library.laser_array(laser_path_lookup[laser_name])
+        wavelength = laser[:,0]
+        # power is linear in the 1/d² and knob terms, so only the chain needs the spectrum
+        chain_total = power_from_counts(wavelength,laser[:,3] * np.power(10,-chain_od(chain,wavelength,fiber_length)))
+        power[i] = chain_total / (distances[:,None]**2) * scale[None,:]
+    return power
+
+
+def split_power(chain,splitter,transmitted,reflected,lasers,distances,knobs,fiber_length=1):
+    """ (n_lasers x 2 x n_distances x n_knobs) power at the sample of the transmitted and the reflected arm
+    of a splitter placed after the chain, each arm followed by its own chain"""
+    from opticalGraph import OpticalGraph, REFLECTED
+    from opticalElement import OpticalElement
+
+    library = get_library()
+    distances = np.asarray(distances,dtype=float)
+    scale = knob_scale(knobs)
+    element = lambda name,pos: OpticalElement(name=name,pos=pos,csv_path=component_path(name),length=fiber_length)
+    power = np.empty((len(lasers),2,len(distances),len(scale)))
+    for i,laser_name in enumerate(lasers):
+        laser = library.laser_array(laser_path_lookup[laser_name])
+        graph = OpticalGraph(laser[:,0])
+        parent = None
+        for name in chain:
+            parent = graph.add_element(len(graph),element(name,len(graph)+1),parent=parent)
+        graph.add_splitter('splitter',element(splitter,len(graph)+1),parent=parent)
+        for sample,arm,names in [('transmitted','splitter',transmitted),('reflected',('splitter',REFLECTED),reflected)]:
+            for name in names:
+                arm = graph.add_element(len(graph),element(name,len(graph)+1),parent=arm)
+            graph.add_sample(sample,parent=arm)
+        powers = graph.powers(laser[:,3])
+        arms = np.array([powers['transmitted'],powers['reflected']])
+        power[i] = arms[:,None,None] / (distances[None,:,None]**2) * scale[None,None,:]
+    return power
+
+
+def _chain_power_job(args):
+    return chain_power(*args)
+
+
+def power_sweep(chains,lasers=None,distances=(1,),knobs=(0,),fiber_length=1,processes=None):
+    """ Power at the sample for every combination of laser, chain, distance and knob value.
+    Chains are spread over a process pool, distance and knob axes are broadcast.
+    Returns a tidy DataFrame with laser, chain, distance, knob and power columns"""
+    lasers = list(laser_path_lookup.keys()) if lasers is None else list(lasers)
+    chains = [tuple(c) for c in chains]
+    distances = list(distances)
+    knobs = list(knobs)
+
+    jobs = [(c,lasers,distances,knobs,fiber_length) for c in chains]
+    processes = pool_size(len(jobs),processes)
+    results = map_jobs(_chain_power_job,jobs,processes,
+                       components={n:component_path(n) for c in chains for n in c},
+                       lasers={n:laser_path_lookup[n] for n in lasers},
+                       chunksize=max(len(jobs)//(4*processes),1))
+
+    import pandas as pd
+    power = np.stack(results) if len(results) else np.empty((0,len(lasers),len(distances),len(knobs)))
+    index = pd.MultiIndex.from_tuples(list(product([' > '.join(c) for c in chains],lasers,distances,knobs)),
+                                      names=['chain','laser','distance','knob'])
+    return pd.DataFrame({'power':power.ravel()},index=index).reset_index()
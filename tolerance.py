@@ -0,0 +1,87 @@
+""" Monte Carlo tolerance analysis of the power at the sample, does not need bokeh.
+Every realization shifts the band edges and scales the OD of each component, shifts the laser spectrum
+and moves the sample, all drawn from normal distributions. Realizations are propagated as
+(samples x wavelengths) arrays in chunks spread over a process pool.
+
+    >>> from tolerance import tolerance_analysis
+    >>> tolerance_analysis('445nm Blue',['Semrock 468 SP','Fiber'],distance=3,n_samples=10000)
+"""
+import numpy as np
+
+from spectralLibrary import get_library, laser_path_lookup
+from catalog import component_path
+from propagation import power_from_counts, interp_rows, map_jobs
+from sweep import chain_od, chain_power
+
+# standard deviations of the perturbations
+DEFAULT_TOLERANCES = {'edge_shift':1.0,    # nm, position of the filter edges
+                      'od_scale':0.05,     # relative, OD of the filters
+                      'laser_shift':0.5,   # nm, laser center wavelength
+                      'distance':0.1}      # mm, sample distance
+SUMMARY_PERCENTILES = [1,5,25,50,75,95,99]
+
+
+def shift_rows(y,x,shifts):
+    """ y(x - shift) on the x axis for every shift, (n_shifts x n_x).
+    Linear interpolation, values are held constant outside of x"""
+    return interp_rows(x[None,:] - shifts[:,None],x,y)
+
+
+def _sample_chunk(args):
+    """ Power at the sample of n perturbed realizations"""
+    laser_name,chain,distance,fiber_length,tolerances,n,seed = args
+    rng = np.random.default_rng(seed)
+    laser = get_library().laser_array(laser_path_lookup[laser_name])
+    wavelength = laser[:,0]
+
+    od = np.zeros((n,len(wavelength)))
+    for name in chain:
+        comp_od = chain_od([name],wavelength,fiber_length)
+        shifts = rng.normal(0,tolerances['edge_shift'],n)
+        scale = rng.normal(1,tolerances['od_scale'],n)
+        if np.all(comp_od == comp_od[0]):
+            # flat spectra (e.g. Fiber) have no edges to shift
+            od += scale[:,None] * comp_od
+        else:
+            od += scale[:,None] * shift_rows(comp_od,wavelength,shifts)
+    counts = shift_rows(laser[:,3],wavelength,rng.normal(0,tolerances['laser_shift'],n))
+    distances = np.abs(distance + rng.normal(0,tolerances['distance'],n))
+    return power_from_counts(wavelength,counts * np.power(10,-od)) / distances**2
+
+
+def sampled_power(laser_name,chain,distance=1,fiber_length=1,tolerances=None,n_samples=10000,
+                  chunk_size=1000,seed=None,processes=None):
+    """ (n_samples,) power at the sample of perturbed realizations of the chain.
+    Results only depend on the seed, not on the number of processes"""
+    tol = dict(DEFAULT_TOLERANCES)
+    tol.update(tolerances or {})
+    chain = tuple(chain)
+
+    sizes = [min(chunk_size,n_samples - i) for i in range(0,n_samples,chunk_size)]
+    seeds = np.random.SeedSequence(seed).spawn(len(sizes))
+    jobs = [(laser_name,chain,distance,fiber_length,tol,n,s) for n,s in zip(sizes,seeds)]
+    results = map_jobs(_sample_chunk,jobs,processes,
+                       components={n:component_path(n) for n in chain},
+                       lasers={laser_name:laser_path_lookup[laser_name]})
+    return np.concatenate(results) if len(results) else np.empty(0)
+
+
+def summarize(power,nominal):
+    """ Nominal power, mean, spread and percentiles of the sampled powers"""
+    summary = {'nominal':nominal,
+               'mean':float(np.mean(power)),
+               'std':float(np.std(power)),
+               'min':float(np.min(power)),
+               'max':float(np.max(power))}
+    for p,v in zip(SUMMARY_PERCENTILES,np.percentile(power,SUMMARY_PERCENTILES)):
+        summary['p{0}'.format(p)] = float(v)
+    return summary
+
+
+def tolerance_analysis(laser_name,chain,distance=1,fiber_length=1,tolerances=None,n_samples=10000,
+                       chunk_size=1000,seed=None,processes=None):
+    """ Summary of the power at the sample distribution, see sampled_power.
+    Returns (summary dict, sampled powers)"""
+    power = sampled_power(laser_name,chain,distance,fiber_length,tolerances,n_samples,chunk_size,seed,processes)
+    nominal = float(chain_power(chain,[laser_name],[distance],[0],fiber_length)[0,0,0])
+    return summarize(power,nominal),power